@@ -0,0 +1,300 @@
+import argparse
+import json
+import random
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = (
+    "the quick brown fox jumps over lazy dog lorem ipsum dolor sit amet "
+    "anon thread board reply image post bump archive catalog"
+).split()
+
+
+class synthetic_world:
+    """Synthetic boards, threads and posts that change as they are requested.
+
+    The world advances one tick every ``tick_requests`` requests. On each tick a
+    ``replies_per_tick`` fraction of the live threads gets a reply and a
+    ``churn`` fraction dies (moving to the archive) and is replaced by a new
+    thread. Time is a virtual clock that advances one second per tick, so
+    ``Last-Modified`` values change on every tick however fast the collector
+    requests, and runs with the same ``seed`` are reproducible.
+    """
+
+    def __init__(
+        self,
+        boards: int = 3,
+        threads: int = 100,
+        initial_replies: int = 20,
+        replies_per_tick: float = 0.1,
+        churn: float = 0.01,
+        post_size: int = 200,
+        tick_requests: int = 10,
+        not_found_rate: float = 0.0,
+        honour_if_modified_since: bool = True,
+        bump_limit: int = 300,
+        seed: int = 0,
+    ):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.now = 1_600_000_000
+        self.requests = 0
+        self.replies_per_tick = replies_per_tick
+        self.churn = churn
+        self.post_size = post_size
+        self.tick_requests = tick_requests
+        self.not_found_rate = not_found_rate
+        self.honour_if_modified_since = honour_if_modified_since
+        self.bump_limit = bump_limit
+        self.threads_per_board = threads
+        self._next_no = 1
+        self._boards = {}
+        self._archive = {}
+        self._cache = {}
+        for number in range(boards):
+            board = f"b{number}"
+            self._boards[board] = {}
+            self._archive[board] = {}
+            for _ in range(threads):
+                self._new_thread(board, initial_replies)
+
+    def _text(self, length: int):
+        words = []
+        size = 0
+        while size < length:
+            word = self._random.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return " ".join(words)[:length]
+
+    def _post(self, resto: int):
+        no = self._next_no
+        self._next_no += 1
+        post = {
+            "no": no,
+            "now": formatdate(self.now, usegmt=True),
+            "name": "Anonymous",
+            "time": self.now,
+            "resto": resto,
+        }
+        if resto:
+            post["com"] = f"&gt;&gt;{resto}<br>" + self._text(self.post_size)
+        else:
+            post["sub"] = self._text(32)
+            post["com"] = self._text(self.post_size)
+        return post
+
+    def _new_thread(self, board: str, replies: int = 0):
+        op = self._post(0)
+        posts = [op] + [self._post(op["no"]) for _ in range(replies)]
+        op["replies"] = replies
+        self._boards[board][op["no"]] = {"posts": posts, "last_modified": self.now}
+
+    def _reply(self, board: str, no: int):
+        thread = self._boards[board][no]
+        thread["posts"].append(self._post(no))
+        thread["posts"][0]["replies"] += 1
+        thread["last_modified"] = self.now
+        if thread["posts"][0]["replies"] >= self.bump_limit:
+            thread["posts"][0]["bumplimit"] = 1
+        self._cache.pop((board, no), None)
+
+    def tick(self):
+        self.now += 1
+        for board, threads in self._boards.items():
+            live = list(threads)
+            for no in self._random.sample(
+                live, min(len(live), round(self.replies_per_tick * len(live)))
+            ):
+                self._reply(board, no)
+            for no in self._random.sample(
+                live, min(len(live), round(self.churn * len(live)))
+            ):
+                thread = threads.pop(no)
+                thread["posts"][0]["archived"] = 1
+                thread["posts"][0]["archived_on"] = self.now
+                self._archive[board][no] = thread
+                self._cache.pop((board, no), None)
+                self._new_thread(board)
+            self._cache.pop((board, "threads.json"), None)
+            self._cache.pop((board, "catalog.json"), None)
+
+    def _pages(self, board: str):
+        # Threads in bump order, 15 to a page as on 4chan.
+        threads = sorted(
+            self._boards[board].items(),
+            key=lambda item: item[1]["last_modified"],
+            reverse=True,
+        )
+        return [threads[start : start + 15] for start in range(0, len(threads), 15)]
+
+    def boards_json(self):
+        pages = -(-self.threads_per_board // 15)
+        return {
+            "boards": [
+                {
+                    "board": board,
+                    "title": board,
+                    "pages": pages,
+                    "per_page": 15,
+                    "bump_limit": self.bump_limit,
+                    "is_archived": 1,
+                }
+                for board in self._boards
+            ]
+        }
+
+    def threads_json(self, board: str):
+        return [
+            {
+                "page": number,
+                "threads": [
+                    {
+                        "no": no,
+                        "last_modified": thread["last_modified"],
+                        "replies": thread["posts"][0]["replies"],
+                    }
+                    for no, thread in page
+                ],
+            }
+            for number, page in enumerate(self._pages(board), start=1)
+        ]
+
+    def catalog_json(self, board: str):
+        catalog = []
+        for number, page in enumerate(self._pages(board), start=1):
+            entries = []
+            for no, thread in page:
+                posts = thread["posts"]
+                last_replies = posts[1:][-5:]
+                entries.append(
+                    {
+                        **posts[0],
+                        "last_modified": thread["last_modified"],
+                        "omitted_posts": len(posts) - 1 - len(last_replies),
+                        "last_replies": last_replies,
+                    }
+                )
+            catalog.append({"page": number, "threads": entries})
+        return catalog
+
+    def respond(self, path: str, if_modified_since: float = None):
+        """Return ``(status, body bytes, last modified)`` for a request path."""
+        with self._lock:
+            self.requests += 1
+            if self.requests % self.tick_requests == 0:
+                self.tick()
+            parts = path.strip("/").split("/")
+            if path == "/boards.json":
+                return 200, json.dumps(self.boards_json()).encode(), self.now
+            board = parts[0]
+            if board not in self._boards or len(parts) < 2:
+                return 404, b"", None
+            if parts[1] in ("threads.json", "catalog.json"):
+                last_modified = max(
+                    thread["last_modified"] for thread in self._boards[board].values()
+                )
+                if self._not_modified(last_modified, if_modified_since):
+                    return 304, b"", last_modified
+                key = (board, parts[1])
+                if key not in self._cache:
+                    document = (
+                        self.threads_json(board)
+                        if parts[1] == "threads.json"
+                        else self.catalog_json(board)
+                    )
+                    self._cache[key] = json.dumps(document).encode()
+                return 200, self._cache[key], last_modified
+            if parts[1] == "archive.json":
+                return 200, json.dumps(list(self._archive[board])).encode(), self.now
+            if parts[1] == "thread" and len(parts) == 3:
+                no = int(parts[2].removesuffix(".json"))
+                thread = self._boards[board].get(no) or self._archive[board].get(no)
+                if thread is None or self._random.random() < self.not_found_rate:
+                    return 404, b"", None
+                if self._not_modified(thread["last_modified"], if_modified_since):
+                    return 304, b"", thread["last_modified"]
+                if (board, no) not in self._cache:
+                    self._cache[(board, no)] = json.dumps(
+                        {"posts": thread["posts"]}
+                    ).encode()
+                return 200, self._cache[(board, no)], thread["last_modified"]
+            return 404, b"", None
+
+    def _not_modified(self, last_modified: int, if_modified_since: float):
+        return (
+            self.honour_if_modified_since
+            and if_modified_since is not None
+            and last_modified <= if_modified_since
+        )
+
+
+def make_server(world: synthetic_world, port: int = 0, host: str = "127.0.0.1"):
+    class handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, which Nagle's algorithm
+        # would otherwise hold back for a delayed ACK on every response.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            since = self.headers.get("If-Modified-Since")
+            if since is not None:
+                since = parsedate_to_datetime(since).timestamp()
+            status, body, last_modified = world.respond(self.path, since)
+            self.send_response(status)
+            if last_modified is not None:
+                self.send_header(
+                    "Last-Modified", formatdate(last_modified, usegmt=True)
+                )
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(world_kwargs: dict, ready=None, port: int = 0):
+    """Serve a synthetic world until killed, putting the port on ``ready`` if given."""
+    server = make_server(synthetic_world(**world_kwargs), port)
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Serve a synthetic 4chan API for benchmarking the requester"
+    )
+    argparser.add_argument("-p", "--port", type=int, default=8080)
+    argparser.add_argument("--boards", type=int, default=3)
+    argparser.add_argument("--threads", type=int, default=100)
+    argparser.add_argument("--post-size", type=int, default=200)
+    argparser.add_argument("--churn", type=float, default=0.01)
+    argparser.add_argument("--replies-per-tick", type=float, default=0.1)
+    argparser.add_argument("--not-found-rate", type=float, default=0.0)
+    argparser.add_argument(
+        "--ignore-if-modified-since",
+        action="store_true",
+        help="Never answer 304 Not Modified",
+    )
+    args = argparser.parse_args()
+    print(f"Serving on http://127.0.0.1:{args.port}")
+    serve(
+        dict(
+            boards=args.boards,
+            threads=args.threads,
+            post_size=args.post_size,
+            churn=args.churn,
+            replies_per_tick=args.replies_per_tick,
+            not_found_rate=args.not_found_rate,
+            honour_if_modified_since=not args.ignore_if_modified_since,
+        ),
+        port=args.port,
+    )
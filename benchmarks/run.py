@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import mock_api
+
+# Synthetic worlds served to the requester, see mock_api.synthetic_world.
+SCENARIOS = {
+    "small": dict(boards=3, threads=50),
+    "medium": dict(boards=10, threads=200),
+    "large": dict(boards=4, threads=2000),
+    "xlarge": dict(boards=2, threads=5000, post_size=400),
+    "churn": dict(boards=3, threads=500, churn=0.05, replies_per_tick=0.3),
+    "flaky": dict(
+        boards=3, threads=300, not_found_rate=0.05, honour_if_modified_since=False
+    ),
+}
+
+
+def _samples(snapshot: dict, name: str):
+    return snapshot["metrics"].get(name, [])
+
+
+def _completed_passes(snapshot: dict):
+    for sample in _samples(snapshot, "fourtct_phase_seconds"):
+        if sample["labels"].get("phase") == "pass":
+            return sample["count"]
+    return 0
+
+
+def _folder_size(folder: Path):
+    files = 0
+    size = 0
+    for path in folder.rglob("*"):
+        if path.is_file():
+            files += 1
+            size += path.stat().st_size
+    return files, size
+
+
+def _peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _collect(port, requester_kwargs, passes, timeout, data_folder, results):
+    os.chdir(data_folder)
+    from requester import requester
+
+    collector = requester(
+        False,
+        False,
+        request_time_limit=0,
+        board_interval=0,
+        api_base=f"http://127.0.0.1:{port}",
+        stream_log_level=logging.WARNING,
+        metrics_interval=0,
+        **requester_kwargs,
+    )
+    cpu_before = os.times()
+    started = time.monotonic()
+    collector.begin_monitoring()
+    while (
+        time.monotonic() - started < timeout
+        and _completed_passes(collector.metrics.snapshot()) < passes
+    ):
+        time.sleep(0.1)
+    collector.end_monitoring()
+    elapsed = time.monotonic() - started
+    cpu_after = os.times()
+    snapshot = collector.metrics.snapshot()
+
+    statuses = {}
+    latency = {}
+    for sample in _samples(snapshot, "fourtct_responses_total"):
+        status = sample["labels"]["status"]
+        statuses[status] = statuses.get(status, 0) + sample["value"]
+    for sample in _samples(snapshot, "fourtct_request_seconds"):
+        latency[sample["labels"]["endpoint"]] = sample["sum"] / sample["count"]
+    requests = sum(statuses.values())
+    saves_files, saves_bytes = _folder_size(Path(data_folder) / "data" / "saves")
+    results.put(
+        {
+            "passes": _completed_passes(snapshot),
+            "seconds": elapsed,
+            "requests": requests,
+            "requests_per_second": requests / elapsed,
+            "statuses": statuses,
+            "mean_latency": latency,
+            "phases": {
+                sample["labels"]["phase"]: sample["sum"]
+                for sample in _samples(snapshot, "fourtct_phase_seconds")
+            },
+            "cpu_user_seconds": cpu_after.user - cpu_before.user,
+            "cpu_system_seconds": cpu_after.system - cpu_before.system,
+            "bytes_written": sum(
+                sample["value"]
+                for sample in _samples(snapshot, "fourtct_bytes_written_total")
+            ),
+            "files_touched": sum(
+                sample["value"]
+                for sample in _samples(snapshot, "fourtct_files_touched_total")
+            ),
+            "saves_files": saves_files,
+            "saves_bytes": saves_bytes,
+            "peak_memory_bytes": _peak_memory(),
+        }
+    )
+
+
+def run_scenario(
+    world_kwargs: dict,
+    requester_kwargs: dict = None,
+    passes: int = 3,
+    timeout: float = 600,
+    data_folder: Path = None,
+):
+    """Run a requester against a synthetic world until it completes ``passes`` passes.
+
+    The mock API and the requester each run in a fresh process, so the
+    requester's CPU time and peak memory are its own. Data is written to a
+    temporary folder unless ``data_folder`` is given.
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    server = context.Process(
+        target=mock_api.serve, args=(world_kwargs, ready), daemon=True
+    )
+    server.start()
+    temporary = None
+    if data_folder is None:
+        data_folder = temporary = tempfile.mkdtemp(prefix="4tct-benchmark-")
+    Path(data_folder).mkdir(parents=True, exist_ok=True)
+    try:
+        port = ready.get(timeout=300)
+        results = context.Queue()
+        collector = context.Process(
+            target=_collect,
+            args=(
+                port,
+                requester_kwargs or {},
+                passes,
+                timeout,
+                str(data_folder),
+                results,
+            ),
+        )
+        collector.start()
+        result = results.get()
+        collector.join()
+        return result
+    finally:
+        server.terminate()
+        server.join()
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+
+def _report(name: str, result: dict):
+    megabyte = 1024 * 1024
+    print(f"== {name}")
+    print(
+        f"  {result['passes']} passes in {result['seconds']:.1f}s, {result['requests']} requests, {result['requests_per_second']:.1f} requests/s"
+    )
+    print(
+        "  statuses: "
+        + ", ".join(
+            f"{status}: {count}" for status, count in result["statuses"].items()
+        )
+    )
+    print(
+        "  mean latency: "
+        + ", ".join(
+            f"{endpoint} {seconds * 1000:.1f}ms"
+            for endpoint, seconds in result["mean_latency"].items()
+        )
+    )
+    print(
+        "  phases: "
+        + ", ".join(
+            f"{phase} {seconds:.1f}s" for phase, seconds in result["phases"].items()
+        )
+    )
+    print(
+        f"  cpu: {result['cpu_user_seconds']:.1f}s user, {result['cpu_system_seconds']:.1f}s system"
+    )
+    print(
+        f"  written: {result['bytes_written'] / megabyte:.1f} MiB in {result['files_touched']} file writes, saves folder {result['saves_bytes'] / megabyte:.1f} MiB in {result['saves_files']} files"
+    )
+    if result["peak_memory_bytes"] is not None:
+        print(f"  peak memory: {result['peak_memory_bytes'] / megabyte:.1f} MiB")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the requester end to end against a local synthetic 4chan API"
+    )
+    argparser.add_argument(
+        "scenarios",
+        nargs="*",
+        default=["small", "medium"],
+        help=f"Scenarios to run, from {', '.join(SCENARIOS)}",
+    )
+    argparser.add_argument(
+        "-s", "--storage", choices=["json", "delta", "segment"], default="json"
+    )
+    argparser.add_argument("-w", "--workers", type=int, default=2)
+    argparser.add_argument(
+        "--writers", type=int, default=2, help="Write-behind writer threads"
+    )
+    argparser.add_argument("--catalog", action="store_true")
+    argparser.add_argument(
+        "--passes", type=int, default=3, help="Collection passes to run per scenario"
+    )
+    argparser.add_argument(
+        "--timeout", type=float, default=600, help="Maximum seconds per scenario"
+    )
+    argparser.add_argument(
+        "--keep", default=None, help="Keep the collected data in this folder"
+    )
+    argparser.add_argument(
+        "--json", default=None, help="Also write the results to this JSON file"
+    )
+    args = argparser.parse_args()
+    requester_kwargs = dict(
+        storage=args.storage,
+        fetch_workers=args.workers,
+        writers=args.writers,
+        use_catalog=args.catalog,
+    )
+    results = {}
+    for name in args.scenarios:
+        data_folder = None if args.keep is None else Path(args.keep) / name
+        results[name] = run_scenario(
+            SCENARIOS[name], requester_kwargs, args.passes, args.timeout, data_folder
+        )
+        _report(name, results[name])
+    if args.json is not None:
+        with open(args.json, "w") as outfile:
+            json.dump(
+                {"requester": requester_kwargs, "results": results}, outfile, indent=2
+            )
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+
+def _owner(board: str, workers: list):
+    # Rendezvous hashing: every worker agrees on the owner of a board without
+    # talking to each other, and a worker joining or leaving only moves the
+    # boards it gains or loses.
+    return max(
+        workers,
+        key=lambda worker: hashlib.sha1(f"{board}/{worker}".encode("utf-8")).digest(),
+    )
+
+
+class shard_member:
+    """Membership of one requester in a group of workers splitting the boards.
+
+    Workers coordinate through a shared folder, on one host or on a file system
+    shared between hosts: each worker keeps a heartbeat file in
+    ``<folder>/workers/`` up to date from a background thread, and a worker
+    whose heartbeat is older than ``ttl`` seconds is considered gone. Boards are
+    assigned to the live workers by rendezvous hashing, so the assignment is
+    deterministic and rebalances by itself when workers join or leave.
+    """
+
+    def __init__(self, folder: Path, worker_id: str = None, ttl: float = 60):
+        self.folder = Path(folder) / "workers"
+        self.folder.mkdir(parents=True, exist_ok=True)
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self._workers = [worker_id]
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def _heartbeat_path(self):
+        return self.folder / (self.worker_id + ".json")
+
+    def heartbeat(self):
+        """Refresh our heartbeat file and the list of live workers."""
+        temporary = self._heartbeat_path.with_suffix(".tmp")
+        with open(temporary, "w") as heartbeat_file:
+            json.dump(
+                {
+                    "worker": self.worker_id,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "heartbeat": time.time(),
+                },
+                heartbeat_file,
+            )
+        os.replace(temporary, self._heartbeat_path)
+
+        workers = []
+        now = time.time()
+        for path in self.folder.glob("*.json"):
+            try:
+                with open(path, "r") as heartbeat_file:
+                    beat = json.load(heartbeat_file)
+            except (OSError, json.decoder.JSONDecodeError):
+                continue
+            if now - beat["heartbeat"] <= self.ttl:
+                workers.append(beat["worker"])
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        self._workers = sorted(workers)
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            self.heartbeat()
+
+    def start(self):
+        self.heartbeat()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._beat, name="heartbeat", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop heartbeating and leave the group, handing our boards to the others."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._heartbeat_path.unlink(missing_ok=True)
+
+    def workers(self):
+        return list(self._workers)
+
+    def owns(self, board: str) -> bool:
+        return _owner(board, self._workers) == self.worker_id
+
+    def assign(self, boards: list):
+        """The subset of ``boards`` this worker is responsible for."""
+        workers = self._workers
+        return [board for board in boards if _owner(board, workers) == self.worker_id]
+
+
+def _run_worker(requester_kwargs: dict):
+    from requester import requester
+
+    requester(True, **requester_kwargs)
+
+
+def run_local_workers(
+    count: int,
+    folder: Path,
+    requester_kwargs: dict,
+    share_rate_limit: bool = True,
+    restart_delay: float = 10,
+):
+    """Run ``count`` requester processes on this host that split the boards between them.
+
+    Each worker gets its own log folder and worker id in ``folder``. With
+    ``share_rate_limit`` the request rate budget is divided between the
+    workers, as they share this host's IP address; turn it off only when each
+    worker makes its requests through a different address. Workers that exit
+    are restarted after ``restart_delay`` seconds until interrupted.
+    """
+    if requester_kwargs.get("stream") in ("-", "stdout"):
+        raise ValueError("Workers cannot share stdout as their stream")
+    requester_kwargs = dict(requester_kwargs)
+    if share_rate_limit:
+        requester_kwargs["request_time_limit"] = (
+            requester_kwargs.get("request_time_limit", 1) * count
+        )
+    logfolderpath = requester_kwargs.pop("logfolderpath", "logs")
+    worker_kwargs = {}
+    processes = {}
+    for number in range(count):
+        worker_id = f"{socket.gethostname()}-worker{number}"
+        worker_kwargs[worker_id] = dict(
+            requester_kwargs,
+            shard_folder=str(folder),
+            worker_id=worker_id,
+            logfolderpath=str(Path(logfolderpath) / worker_id),
+        )
+        if requester_kwargs.get("metrics_port") is not None:
+            worker_kwargs[worker_id]["metrics_port"] = (
+                requester_kwargs["metrics_port"] + number
+            )
+        if requester_kwargs.get("stream") is not None:
+            worker_kwargs[worker_id]["stream"] = (
+                f"{requester_kwargs['stream']}.{worker_id}"
+            )
+    try:
+        while True:
+            for worker_id, kwargs in worker_kwargs.items():
+                process = processes.get(worker_id)
+                if process is not None and process.is_alive():
+                    continue
+                # A restarted worker keeps its id, and with it its boards.
+                processes[worker_id] = multiprocessing.Process(
+                    target=_run_worker, args=(kwargs,), name=worker_id
+                )
+                processes[worker_id].start()
+            time.sleep(restart_delay)
+    finally:
+        for worker_id, process in processes.items():
+            process.terminate()
+            process.join()
+            (Path(folder) / "workers" / (worker_id + ".json")).unlink(missing_ok=True)
@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+from storage import compact_thread, segment_reader
+
+post_record = namedtuple("post_record", ["board", "day", "thread", "post"])
+
+_DAY_FOLDER = re.compile(r"^\d{4}_\d{2}_\d{2}$")
+
+
+def _day_name(day):
+    if day is None:
+        return None
+    if isinstance(day, date):
+        return day.strftime("%Y_%m_%d")
+    return str(day).replace("-", "_")
+
+
+def _day_sources(day_folder: Path, boards, threads):
+    """List ``(board, thread, time, source)`` for every capture stored in a day folder."""
+    day = day_folder.name
+    candidates = []
+    threads_folder = day_folder / "threads"
+    if threads_folder.is_dir():
+        for board_folder in threads_folder.iterdir():
+            if boards is not None and board_folder.name not in boards:
+                continue
+            names = {path.name: path for path in board_folder.iterdir()}
+            for name, path in names.items():
+                if path.suffix not in (".json", ".jsonl"):
+                    continue
+                if path.suffix == ".json" and path.stem + ".jsonl" in names:
+                    # Compacted copy of an append-only segment.
+                    continue
+                no, _, captured = path.stem.partition("_")
+                no = int(no)
+                if threads is not None and no not in threads:
+                    continue
+                candidates.append(
+                    (
+                        board_folder.name,
+                        no,
+                        captured,
+                        ("file", board_folder.name, day, no, str(path)),
+                    )
+                )
+    segments_folder = day_folder / "segments"
+    if segments_folder.is_dir():
+        for segment in segments_folder.glob("*.seg"):
+            board = segment.stem
+            if boards is not None and board not in boards:
+                continue
+            for no, versions in segment_reader(segment).versions.items():
+                if threads is not None and no not in threads:
+                    continue
+                for version, entry in enumerate(versions):
+                    captured = time.strftime("%H_%M_%S", time.gmtime(entry["captured"]))
+                    candidates.append(
+                        (
+                            board,
+                            no,
+                            captured,
+                            ("segment", board, day, no, str(segment), version),
+                        )
+                    )
+    return candidates
+
+
+def iter_thread_sources(
+    saves: Path,
+    boards: list = None,
+    start_day=None,
+    end_day=None,
+    threads: list = None,
+    latest_only: bool = True,
+):
+    """Yield a source for every thread capture in a saves tree, newest day first.
+
+    With ``latest_only`` a thread captured on several days (or several times in
+    one day) is only yielded once, for its latest capture. Only the set of
+    threads already yielded is held in memory.
+    """
+    start_day = _day_name(start_day)
+    end_day = _day_name(end_day)
+    if boards is not None:
+        boards = set(boards)
+    if threads is not None:
+        threads = {int(thread) for thread in threads}
+    day_folders = sorted(
+        (
+            path
+            for path in Path(saves).iterdir()
+            if path.is_dir() and _DAY_FOLDER.match(path.name)
+        ),
+        reverse=True,
+    )
+    seen = set()
+    for day_folder in day_folders:
+        if start_day is not None and day_folder.name < start_day:
+            continue
+        if end_day is not None and day_folder.name > end_day:
+            continue
+        candidates = _day_sources(day_folder, boards, threads)
+        if not latest_only:
+            for candidate in candidates:
+                yield candidate[3]
+            continue
+        latest = {}
+        for board, no, captured, source in candidates:
+            if (board, no) in seen:
+                continue
+            if (board, no) not in latest or latest[(board, no)][0] <= captured:
+                latest[(board, no)] = (captured, source)
+        seen.update(latest)
+        for _, source in latest.values():
+            yield source
+
+
+def _read_sources(sources: list):
+    records = []
+    readers = {}
+    for source in sources:
+        if source[0] == "file":
+            _, board, day, no, path = source
+            if path.endswith(".jsonl"):
+                thread = compact_thread(path)
+            else:
+                with open(path, "r") as infile:
+                    try:
+                        thread = json.load(infile)
+                    except json.decoder.JSONDecodeError:
+                        continue
+        else:
+            _, board, day, no, path, version = source
+            if path not in readers:
+                readers[path] = segment_reader(path)
+            thread = readers[path].read(no, version)
+        if not thread:
+            continue
+        records.extend(
+            post_record(board, day, no, post) for post in thread.get("posts", [])
+        )
+    return records
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_posts(
+    saves: Path,
+    boards: list = None,
+    start_day=None,
+    end_day=None,
+    threads: list = None,
+    latest_only: bool = True,
+    processes: int = None,
+    chunksize: int = 64,
+):
+    """Stream every post in a saves tree as ``post_record(board, day, thread, post)``.
+
+    Handles the per-thread JSON and JSONL files under
+    ``saves/<day>/threads/<board>/`` as well as compressed segments. Filter with
+    ``boards``, an inclusive ``start_day``/``end_day`` range (dates or
+    ``YYYY_MM_DD`` strings) and ``threads``. Threads are read in chunks of
+    ``chunksize`` by ``processes`` worker processes (all cores by default, 1 to
+    read in this process), with at most two chunks per worker in flight so
+    memory stays bounded however large the date range.
+    """
+    chunks = _chunks(
+        iter_thread_sources(
+            saves, boards, start_day, end_day, threads, latest_only=latest_only
+        ),
+        chunksize,
+    )
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1:
+        for chunk in chunks:
+            yield from _read_sources(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(_read_sources, chunk))
+            if len(in_flight) >= 2 * processes:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Stream the posts in a 4TCT saves folder as JSON lines"
+    )
+    argparser.add_argument("saves", help="The saves folder, e.g. data/saves")
+    argparser.add_argument(
+        "-b", "--boards", nargs="*", default=None, help="Only read these boards"
+    )
+    argparser.add_argument(
+        "--start", default=None, help="First day to read, e.g. 2023_07_01"
+    )
+    argparser.add_argument(
+        "--end", default=None, help="Last day to read, e.g. 2023_07_31"
+    )
+    argparser.add_argument(
+        "-t", "--threads", nargs="*", default=None, help="Only read these threads"
+    )
+    argparser.add_argument(
+        "--all-captures",
+        action="store_true",
+        help="Read every capture of a thread rather than only its latest",
+    )
+    argparser.add_argument(
+        "-p", "--processes", type=int, default=None, help="Number of reader processes"
+    )
+    args = argparser.parse_args()
+    for record in iter_posts(
+        args.saves,
+        boards=args.boards,
+        start_day=args.start,
+        end_day=args.end,
+        threads=args.threads,
+        latest_only=not args.all_captures,
+        processes=args.processes,
+    ):
+        sys.stdout.write(
+            json.dumps(
+                {
+                    "board": record.board,
+                    "day": record.day,
+                    "thread": record.thread,
+                    **record.post,
+                }
+            )
+            + "\n"
+        )
@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from storage import compact_thread, segment_reader
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_REPLY_LINK = re.compile(r"&gt;&gt;(\d+)")
+_DAY_FOLDER = re.compile(r"^\d{4}_\d{2}_\d{2}$")
+
+
+def _capture_order(path: Path):
+    return path.stem.partition("_")[2]
+
+
+def _schema():
+    return pyarrow.schema(
+        [
+            ("thread", pyarrow.int64()),
+            ("no", pyarrow.int64()),
+            ("time", pyarrow.timestamp("s", tz="UTC")),
+            ("name", pyarrow.string()),
+            ("com", pyarrow.string()),
+            ("reply_links", pyarrow.list_(pyarrow.int64())),
+        ]
+    )
+
+
+class post_exporter:
+    """Incremental export of collected posts to Parquet files.
+
+    Posts are written to ``<export>/board=<board>/day=<YYYY-MM-DD>/`` partitions,
+    keyed by the UTC day the post was made, which any Arrow dataset reader
+    understands. A manifest in ``<export>/_manifest.sqlite3`` records the size
+    and modification time of every exported file and the last exported post of
+    every thread, so each run only reads files that changed since the last one
+    and only writes posts that were not exported before. Records are buffered
+    per partition and written in row groups of ``row_group_size`` rows.
+    """
+
+    def __init__(self, saves: Path, export: Path, row_group_size: int = 131072):
+        if pyarrow is None:
+            raise ImportError(
+                "Exporting to Parquet requires the pyarrow package: pip install pyarrow"
+            )
+        self.saves = Path(saves)
+        self.export = Path(export)
+        self.export.mkdir(parents=True, exist_ok=True)
+        self.row_group_size = row_group_size
+        self._run = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+        self._manifest = sqlite3.connect(self.export / "_manifest.sqlite3")
+        with self._manifest:
+            self._manifest.execute("""CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER
+                )""")
+            self._manifest.execute("""CREATE TABLE IF NOT EXISTS threads (
+                    board TEXT, thread INTEGER, last_no INTEGER,
+                    PRIMARY KEY (board, thread)
+                )""")
+        self._buffers = {}
+        self._buffered = 0
+        self._writers = {}
+
+    def _changed_files(self):
+        """Yield ``(path, stat, previous size)`` of changed files, oldest day first."""
+        for day_folder in sorted(self.saves.iterdir()):
+            if not (day_folder.is_dir() and _DAY_FOLDER.match(day_folder.name)):
+                continue
+            paths = sorted(day_folder.glob("threads/*/*.json*"), key=_capture_order)
+            paths += sorted(day_folder.glob("segments/*.seg"))
+            for path in paths:
+                if path.suffix == ".json" and path.with_suffix(".jsonl").exists():
+                    continue
+                stat = path.stat()
+                row = self._manifest.execute(
+                    "SELECT mtime_ns, size FROM files WHERE path = ?",
+                    (str(path.relative_to(self.saves)),),
+                ).fetchone()
+                if row is not None and tuple(row) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                previous_size = row[1] if row is not None else 0
+                if stat.st_size < previous_size:
+                    # Compacted since the last export, so offsets have moved.
+                    previous_size = 0
+                yield path, stat, previous_size
+
+    def _threads_in(self, path: Path, previous_size: int):
+        """Yield ``(board, thread, document)`` for the captures in a changed file."""
+        if path.suffix == ".seg":
+            reader = segment_reader(path)
+            for no, versions in reader.versions.items():
+                # Only frames appended since the last export can hold new posts.
+                if versions[-1]["offset"] >= previous_size:
+                    yield path.stem, no, reader.read(no)
+            return
+        if path.suffix == ".jsonl":
+            thread = compact_thread(path)
+        else:
+            with open(path, "r") as infile:
+                try:
+                    thread = json.load(infile)
+                except json.decoder.JSONDecodeError:
+                    return
+        if thread:
+            yield path.parent.name, int(path.name.split("_")[0]), thread
+
+    def _add_posts(self, board: str, thread: int, posts: list):
+        row = self._manifest.execute(
+            "SELECT last_no FROM threads WHERE board = ? AND thread = ?",
+            (board, thread),
+        ).fetchone()
+        last_no = row[0] if row is not None else 0
+        new_last_no = last_no
+        added = 0
+        for post in posts:
+            if post["no"] <= last_no:
+                continue
+            new_last_no = max(new_last_no, post["no"])
+            day = time.strftime("%Y-%m-%d", time.gmtime(post["time"]))
+            buffer = self._buffers.setdefault((board, day), [])
+            buffer.append(
+                (
+                    thread,
+                    post["no"],
+                    post["time"],
+                    post.get("name"),
+                    post.get("com"),
+                    [int(link) for link in _REPLY_LINK.findall(post.get("com", ""))],
+                )
+            )
+            self._buffered += 1
+            added += 1
+            if len(buffer) >= self.row_group_size:
+                self._flush(board, day)
+        if new_last_no != last_no:
+            self._manifest.execute(
+                """INSERT INTO threads (board, thread, last_no) VALUES (?, ?, ?)
+                ON CONFLICT (board, thread) DO UPDATE SET last_no = excluded.last_no""",
+                (board, thread, new_last_no),
+            )
+        return added
+
+    def _flush(self, board: str, day: str):
+        rows = self._buffers.pop((board, day), [])
+        if not rows:
+            return
+        self._buffered -= len(rows)
+        columns = list(zip(*rows))
+        table = pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(columns[0], pyarrow.int64()),
+                pyarrow.array(columns[1], pyarrow.int64()),
+                pyarrow.array(columns[2], pyarrow.int64()).cast(
+                    pyarrow.timestamp("s", tz="UTC")
+                ),
+                pyarrow.array(columns[3], pyarrow.string()),
+                pyarrow.array(columns[4], pyarrow.string()),
+                pyarrow.array(columns[5], pyarrow.list_(pyarrow.int64())),
+            ],
+            schema=_schema(),
+        )
+        writer = self._writers.get((board, day))
+        if writer is None:
+            partition = self.export / f"board={board}" / f"day={day}"
+            partition.mkdir(parents=True, exist_ok=True)
+            # Written under a hidden name, which dataset readers skip, and
+            # only renamed to its part name once the run completes.
+            part = partition / f"part-{self._run}.parquet"
+            temporary = partition / f".{part.name}.tmp"
+            writer = self._writers[(board, day)] = (
+                pyarrow.parquet.ParquetWriter(temporary, _schema()),
+                temporary,
+                part,
+            )
+        writer[0].write_table(table, row_group_size=self.row_group_size)
+
+    def _discard_parts(self):
+        # Drops the part files of a failed run, and any left behind by a run
+        # that was killed.
+        for writer, temporary, _ in self._writers.values():
+            try:
+                writer.close()
+            except Exception:
+                pass
+            temporary.unlink(missing_ok=True)
+        self._writers = {}
+        self._buffers = {}
+        self._buffered = 0
+        for temporary in self.export.glob("board=*/day=*/.part-*.parquet.tmp"):
+            temporary.unlink(missing_ok=True)
+
+    def run(self, max_buffered: int = 1048576):
+        """Export everything that changed since the last run, returning the posts written.
+
+        Nothing is left in the export if the run fails: its part files are
+        removed and the manifest is rolled back, so the next run exports the
+        same posts again.
+        """
+        self._discard_parts()
+        try:
+            exported = self._export(max_buffered)
+            for writer, _, _ in self._writers.values():
+                writer.close()
+        except BaseException:
+            self._discard_parts()
+            self._manifest.rollback()
+            raise
+        for _, temporary, part in self._writers.values():
+            os.replace(temporary, part)
+        self._writers = {}
+        # The manifest is only committed once every part file is complete.
+        self._manifest.commit()
+        return exported
+
+    def _export(self, max_buffered: int):
+        exported = 0
+        for path, stat, previous_size in self._changed_files():
+            for board, thread, document in self._threads_in(path, previous_size):
+                exported += self._add_posts(board, thread, document.get("posts", []))
+                if self._buffered >= max_buffered:
+                    # Bound memory by flushing the largest partitions first.
+                    for partition in sorted(
+                        self._buffers, key=lambda key: -len(self._buffers[key])
+                    ):
+                        if self._buffered < max_buffered // 2:
+                            break
+                        self._flush(*partition)
+            self._manifest.execute(
+                """INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    mtime_ns = excluded.mtime_ns, size = excluded.size""",
+                (str(path.relative_to(self.saves)), stat.st_mtime_ns, stat.st_size),
+            )
+        for partition in list(self._buffers):
+            self._flush(*partition)
+        return exported
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Incrementally export collected posts to partitioned Parquet files"
+    )
+    argparser.add_argument("saves", help="The saves folder, e.g. data/saves")
+    argparser.add_argument("export", help="The export folder, e.g. data/export")
+    argparser.add_argument(
+        "-r",
+        "--row-group-size",
+        type=int,
+        default=131072,
+        help="Rows per Parquet row group",
+    )
+    args = argparser.parse_args()
+    exporter = post_exporter(args.saves, args.export, args.row_group_size)
+    print(f"{exporter.run()} posts exported")
@@ -0,0 +1,160 @@
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as infile, gzip.open(dest, "wb") as outfile:
+        shutil.copyfileobj(infile, outfile)
+    os.remove(source)
+
+
+class rotating_log_file(logging.handlers.RotatingFileHandler):
+    """Log file rotated once it reaches ``max_bytes`` or is ``interval`` seconds old.
+
+    Rotated files are gzipped to ``<name>.1.gz``, ``<name>.2.gz`` and so on,
+    keeping at most ``backups`` of them. A size or interval of 0 disables that
+    trigger.
+    """
+
+    def __init__(
+        self, path: Path, max_bytes: int = 0, interval: float = 0, backups: int = 10
+    ):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.interval = interval
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _gzip_rotator
+        self._opened = time.time()
+
+    def shouldRollover(self, record) -> bool:
+        if (
+            self.interval
+            and self.stream is not None
+            and time.time() - self._opened >= self.interval
+        ):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened = time.time()
+
+
+class sampling_queue_handler(logging.handlers.QueueHandler):
+    """Hands records to a background listener, sampling high volume debug messages.
+
+    The logging call only puts the record on a queue; formatting and writing
+    happen on the listener thread, so messages logged with ``%`` arguments are
+    only built there. Debug records are counted per message template: the
+    first ``burst`` of each template in every ``interval`` seconds are kept, and
+    after that only one in ``sample``. A summary of how many were dropped is
+    logged at the end of the interval. Records of other levels are never
+    sampled.
+    """
+
+    def __init__(
+        self,
+        log_queue: queue.Queue,
+        sample: int = 10,
+        burst: int = 20,
+        interval: float = 60,
+    ):
+        super().__init__(log_queue)
+        self.sample = max(1, sample)
+        self.burst = burst
+        self.interval = interval
+        self._counts = {}
+        self._window = time.monotonic()
+        self._sample_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The listener formats the record, so arguments are left unmerged.
+        return record
+
+    def _summaries(self, force: bool = False):
+        summaries = []
+        now = time.monotonic()
+        with self._sample_lock:
+            if not force and now - self._window < self.interval:
+                return summaries
+            for (name, template), (seen, kept) in self._counts.items():
+                if seen > kept:
+                    summaries.append(
+                        logging.LogRecord(
+                            name,
+                            logging.DEBUG,
+                            __file__,
+                            0,
+                            "Sampled %s of %s debug messages like '%s' in the last %.0fs",
+                            (kept, seen, template, now - self._window),
+                            None,
+                        )
+                    )
+            self._counts = {}
+            self._window = now
+        return summaries
+
+    def _keep(self, record) -> bool:
+        key = (record.name, str(record.msg))
+        with self._sample_lock:
+            seen, kept = self._counts.get(key, (0, 0))
+            seen += 1
+            keep = seen <= self.burst or (seen - self.burst) % self.sample == 0
+            self._counts[key] = (seen, kept + keep)
+        return keep
+
+    def emit(self, record):
+        if record.levelno == logging.DEBUG and self.sample > 1:
+            for summary in self._summaries():
+                super().emit(summary)
+            if not self._keep(record):
+                return
+        super().emit(record)
+
+    def flush_summaries(self):
+        """Log the sampling summary of the current interval straight away."""
+        for summary in self._summaries(force=True):
+            super().emit(summary)
+
+
+def setup_queue_logging(
+    logger: logging.Logger,
+    handlers: list,
+    sample: int = 10,
+    burst: int = 20,
+    interval: float = 60,
+):
+    """Route ``logger`` through a queue to ``handlers`` written on a background thread.
+
+    The logger's level is set to the lowest level of the handlers, so calls
+    below it return before a record is made. Returns the queue handler and a
+    function stopping the listener once every queued record is written, which
+    is also called at exit.
+    """
+    log_queue = queue.Queue()
+    queue_handler = sampling_queue_handler(log_queue, sample, burst, interval)
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    logger.setLevel(min(handler.level for handler in handlers))
+    logger.addHandler(queue_handler)
+    listener.start()
+
+    stopped = threading.Event()
+
+    def stop():
+        if stopped.is_set():
+            return
+        stopped.set()
+        queue_handler.flush_summaries()
+        listener.stop()
+
+    atexit.register(stop)
+    return queue_handler, stop
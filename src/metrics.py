@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_PHASE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Every metric a requester reports: its type, help text and histogram buckets.
+_METRICS = {
+    "fourtct_request_seconds": (
+        "histogram",
+        "Time from sending an API request to receiving its response, by endpoint",
+        _LATENCY_BUCKETS,
+    ),
+    "fourtct_responses_total": (
+        "counter",
+        "API responses received, by endpoint and HTTP status",
+        None,
+    ),
+    "fourtct_retries_total": (
+        "counter",
+        "API requests repeated after an unexpected status, by endpoint",
+        None,
+    ),
+    "fourtct_rate_limit_wait_seconds_total": (
+        "counter",
+        "Time spent waiting for the request rate limiter",
+        None,
+    ),
+    "fourtct_phase_seconds": (
+        "histogram",
+        "Duration of each phase of the collection loop",
+        _PHASE_BUCKETS,
+    ),
+    "fourtct_board_poll_interval_seconds": (
+        "gauge",
+        "Seconds between polls of a board's thread list, learned from its change rate, by board",
+        None,
+    ),
+    "fourtct_queue_depth": ("gauge", "Threads waiting to be captured", None),
+    "fourtct_threads_monitored": ("gauge", "Threads on the monitored boards", None),
+    "fourtct_capture_eta_seconds": (
+        "gauge",
+        "Estimated seconds until every queued thread is captured",
+        None,
+    ),
+    "fourtct_staleness_seconds": (
+        "gauge",
+        "Seconds since monitored threads were last captured, by statistic",
+        None,
+    ),
+    "fourtct_dying_queue_depth": (
+        "gauge",
+        "Threads that left their board waiting for a final capture",
+        None,
+    ),
+    "fourtct_captures_total": (
+        "counter",
+        "Thread captures saved, by source (thread request, catalog or final)",
+        None,
+    ),
+    "fourtct_bytes_written_total": (
+        "counter",
+        "Bytes written to the saves folder, by kind of file",
+        None,
+    ),
+    "fourtct_write_queue_depth": (
+        "gauge",
+        "Captures waiting in the write-behind queue",
+        None,
+    ),
+    "fourtct_write_backpressure_seconds_total": (
+        "counter",
+        "Time fetch threads spent blocked on a full write-behind queue",
+        None,
+    ),
+    "fourtct_fsyncs_total": ("counter", "Files fsynced by the writers", None),
+    "fourtct_fsync_seconds_total": (
+        "counter",
+        "Time the writers spent in fsync",
+        None,
+    ),
+    "fourtct_index_seconds": (
+        "histogram",
+        "Time the writers spent adding a thread's posts to the search index",
+        _LATENCY_BUCKETS,
+    ),
+    "fourtct_posts_indexed_total": (
+        "counter",
+        "Posts added to or updated in the search index",
+        None,
+    ),
+    "fourtct_stream_posts_total": (
+        "counter",
+        "New posts written to the stream",
+        None,
+    ),
+    "fourtct_stream_dropped_total": (
+        "counter",
+        "New posts dropped from the stream, as its buffer was full or its sink failed",
+        None,
+    ),
+    "fourtct_stream_queue_depth": (
+        "gauge",
+        "Posts waiting to be written to the stream",
+        None,
+    ),
+    "fourtct_stream_backpressure_seconds_total": (
+        "counter",
+        "Time capturing was paused waiting for room in the stream buffer",
+        None,
+    ),
+    "fourtct_files_touched_total": (
+        "counter",
+        "Writes to files in the saves folder, by kind of file",
+        None,
+    ),
+}
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()):
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class metrics_registry:
+    """In-process counters, gauges and histograms describing a running requester.
+
+    The registry can be scraped in the Prometheus text format from a small HTTP
+    server (``serve``) and written as a JSON snapshot at a fixed interval
+    (``start_snapshots``). Every metric is declared in ``_METRICS``; labels are
+    passed as keyword arguments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in _METRICS}
+        self._server = None
+        self._stop = threading.Event()
+        self._snapshot_thread = None
+
+    @staticmethod
+    def _key(labels: dict):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values[name][self._key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = _METRICS[name][2]
+        key = self._key(labels)
+        with self._lock:
+            histogram = self._values[name].get(key)
+            if histogram is None:
+                histogram = self._values[name][key] = [[0] * len(buckets), 0.0, 0]
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][position] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of a ``with`` block in a histogram."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def snapshot(self):
+        """Return the current value of every metric as a JSON-serialisable dict."""
+        result = {"time": time.time(), "metrics": {}}
+        with self._lock:
+            for name, values in self._values.items():
+                kind, _, buckets = _METRICS[name]
+                samples = []
+                for key, value in values.items():
+                    sample = {"labels": dict(key)}
+                    if kind == "histogram":
+                        counts, total, count = value
+                        sample["buckets"] = dict(zip(map(str, buckets), counts))
+                        sample["sum"] = total
+                        sample["count"] = count
+                    else:
+                        sample["value"] = value
+                    samples.append(sample)
+                result["metrics"][name] = samples
+        return result
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, values in self._values.items():
+                kind, help_text, buckets = _METRICS[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(values.items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(
+                            f"{name}_bucket{_format_labels(key, (('le', str(bound)),))} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {count}"
+                    )
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path: Path):
+        path = Path(path)
+        temporary = path.with_suffix(".tmp")
+        with open(temporary, "w") as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file, indent=2)
+        os.replace(temporary, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serve ``/metrics`` (Prometheus) and ``/metrics.json`` from a background thread."""
+        registry = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.render().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        ).start()
+        return self._server
+
+    def _write_snapshots(self, path: Path, interval: float):
+        while not self._stop.wait(interval):
+            self.write_snapshot(path)
+
+    def start_snapshots(self, path: Path, interval: float):
+        """Write a JSON snapshot to ``path`` every ``interval`` seconds."""
+        self._stop.clear()
+        self._snapshot_thread = threading.Thread(
+            target=self._write_snapshots,
+            args=(path, interval),
+            name="metrics-snapshot",
+            daemon=True,
+        )
+        self._snapshot_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -3,10 +3,62 @@ import json
 import logging
 import threading
 import time
-from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from coordinator import run_local_workers, shard_member
+from logs import rotating_log_file, setup_queue_logging
+from metrics import metrics_registry
+from scheduler import board_cadence, thread_scheduler
+from search import search_index
+from state import state_store
+from storage import (
+    compact_thread,
+    delta_thread_store,
+    file_index,
+    segment_store,
+    write_behind,
+)
+from stream import open_sink, post_stream
+
+_CATALOG_ONLY_KEYS = (
+    "last_replies",
+    "omitted_posts",
+    "omitted_images",
+    "last_modified",
+)
+
+
+class token_bucket:
+    """Thread-safe token bucket shared by every request a requester makes.
+
+    The bucket holds a single token, so consecutive requests are spaced exactly
+    ``interval`` seconds apart without bursting, however many fetch workers
+    draw from it. Tokens are handed out in the order they are asked for.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_token = time.monotonic()
+
+    def acquire(self) -> float:
+        """Block until a token is available, returning the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_token)
+            self._next_token = slot + self._interval
+        waited = slot - now
+        if waited > 0:
+            time.sleep(waited)
+        return waited
 
 
 class requester:
@@ -19,34 +71,151 @@ class requester:
         request_time_limit: float = 1,
         stream_log_level=logging.INFO,
         logfolderpath: str = "logs",
+        fetch_workers: int = 2,
+        storage: str = "json",
+        compression: str = "gzip",
+        shard_folder: str = None,
+        worker_id: str = None,
+        use_catalog: bool = False,
+        metrics_port: int = None,
+        metrics_host: str = "127.0.0.1",
+        metrics_interval: float = 60,
+        api_base: str = "https://a.4cdn.org",
+        board_interval: float = 10,
+        writers: int = 2,
+        write_queue: int = 256,
+        fsync_interval: float = 5,
+        debug_log: bool = True,
+        debug_sample: int = 10,
+        log_max_bytes: int = 100 * 2**20,
+        log_rotate_interval: float = 86400,
+        log_backups: int = 10,
+        final_captures: int = 50,
+        board_max_interval: float = 600,
+        search: bool = False,
+        stream: str = None,
+        stream_buffer: int = 10000,
+        stream_overflow: str = "block",
+        stream_max_bytes: int = 100 * 2**20,
+        stream_rotate_interval: float = 3600,
     ):
         if run_in_docker:
             self._base_save_path: Path = Path("/data")
         else:
             self._base_save_path: Path = Path().resolve() / "data"
-        self._save_debuglog = True
+        self._save_debuglog = debug_log
         self._stream_log_level = stream_log_level
+        self._debug_sample: int = debug_sample
+        self._log_max_bytes: int = log_max_bytes
+        self._log_rotate_interval: float = log_rotate_interval
+        self._log_backups: int = log_backups
         self._setup_logging(logfolderpath)
+        self.metrics = metrics_registry()
+        self._metrics_port: int = metrics_port
+        self._metrics_host: str = metrics_host
+        self._metrics_interval: float = metrics_interval
+        self._metrics_path: Path = self._base_save_path / logfolderpath / "metrics.json"
 
         self.monitor: bool = monitor
         self._include_boards: list = boards
         self._exclude_boards: bool = exclude_boards
         self._request_time_limit: float = request_time_limit
+        self._api_base: str = api_base.rstrip("/")
+        self._board_interval: float = board_interval
+        self._rate_limiter = token_bucket(request_time_limit)
+        self._fetch_workers: int = max(1, fetch_workers)
+        self._sessions = threading.local()
+        self._fetch_pool = None
+        self._storage: str = storage
+        self._use_catalog: bool = use_catalog
+        self._delta_store = delta_thread_store()
+        self._segment_store = segment_store(compression)
+        self._file_index = file_index()
+        self._writers: int = writers
+        self._write_queue: int = write_queue
+        self._fsync_interval: float = fsync_interval
+        self._writer = None
         self._check_new_boards: bool = True
         self._last_requested = {}
+        self._board_requested = {}
+        self._use_search: bool = search
+        self._state = None
+        self._search = None
+        self._open_stores()
+        self._stream_target: str = stream
+        self._stream_buffer: int = stream_buffer
+        self._stream_overflow: str = stream_overflow
+        self._stream_max_bytes: int = stream_max_bytes
+        self._stream_rotate_interval: float = stream_rotate_interval
+        self._stream = None
+        self._board_info = {}
+        self._scheduler = thread_scheduler()
+        self._cadence = board_cadence(board_interval, board_max_interval)
+        self._final_captures: int = final_captures
+        # Threads that left their board, waiting for a final capture. The
+        # oldest are dropped first if deaths outpace the final capture budget.
+        self._dying = deque(maxlen=10000)
+        self._candidate_boards = []
+        self._shard = None
+        if shard_folder is not None:
+            self._shard = shard_member(shard_folder, worker_id)
 
         self.last_request = None
+        self.monitoring_boards = []
+        self.monitoring_threads = {}
 
         if self.monitor is True:
             self.begin_monitoring()
 
+    def _open_stores(self):
+        # The crawl state and search index are opened with the requester and
+        # again when monitoring restarts, as end_monitoring closes them.
+        self._state = state_store(self._base_save_path / "state.sqlite3")
+        if self._use_search:
+            self._search = search_index(self._base_save_path / "search.sqlite3")
+
     def begin_monitoring(self):
         self._logger.info("Beginning monitoring")
         self._logger.info(f"Storing data in path: {self._base_save_path}")
+        if self._state is None:
+            self._open_stores()
         self.monitor = True
         self.monitoring_boards = []
         self.monitoring_threads = {}
         self._threads_last_checked = {}
+        self._writer = write_behind(
+            self._writers, self._write_queue, self._fsync_interval, self.metrics
+        )
+        # The fetch workers, and so their keep-alive sessions, last for the
+        # whole of monitoring rather than a single pass.
+        self._fetch_pool = ThreadPoolExecutor(
+            max_workers=self._fetch_workers, thread_name_prefix="fetch"
+        )
+        if self._stream_target is not None:
+            self._stream = post_stream(
+                open_sink(
+                    self._stream_target,
+                    self._stream_max_bytes,
+                    self._stream_rotate_interval,
+                ),
+                self._stream_buffer,
+                self._stream_overflow,
+                self._state.last_post_no,
+                self.metrics,
+            )
+            self._logger.info(f"Streaming new posts to {self._stream_target}")
+        if self._metrics_port is not None:
+            self.metrics.serve(self._metrics_port, self._metrics_host)
+            self._logger.info(
+                f"Serving metrics on http://{self._metrics_host}:{self._metrics_port}/metrics"
+            )
+        if self._metrics_interval:
+            self.metrics.start_snapshots(self._metrics_path, self._metrics_interval)
+        if self._shard is not None:
+            self._shard.start()
+            self._logger.info(
+                f"Joined shard group as {self._shard.worker_id}, live workers: {self._shard.workers()}"
+            )
         self._logger.debug("Initialising Monitoring Thread")
         self._monitor_thread = threading.Thread(target=self._begin_monitoring)
         self._logger.debug("Starting Thread")
@@ -56,7 +225,32 @@ class requester:
     def end_monitoring(self):
         self._logger.info("Ending loop and closing monitoring thread")
         self.monitor = False
+        if self._stream is not None:
+            # Fetch threads waiting for room in a full stream buffer would
+            # otherwise keep the monitoring thread from finishing.
+            self._stream.release()
         self._monitor_thread.join()
+        self._fetch_pool.shutdown()
+        self._fetch_pool = None
+        if self._stream is not None:
+            self._logger.info(
+                f"Flushing {self._stream.queued()} queued posts to the stream"
+            )
+            self._stream.close()
+            self._stream = None
+        self._logger.info(f"Flushing {self._writer.queued()} queued writes to disk")
+        self._writer.close()
+        self._writer = None
+        self._state.close()
+        self._state = None
+        if self._search is not None:
+            self._search.close()
+            self._search = None
+        if self._shard is not None:
+            self._shard.stop()
+        self.metrics.stop()
+        if self._metrics_interval:
+            self.metrics.write_snapshot(self._metrics_path)
         self._logger.info("Closed monitoring thread")
 
     def _load_old_monitors(self):
@@ -66,45 +260,105 @@ class requester:
         )
         old_monitor_dict = {}
         old_threads = 0
+        self._indexed_day = self._get_day()
+        self._file_index.build(self._base_save_path / "saves" / self._indexed_day)
+        stored_boards = self._state.boards()
+        stored_threads = self._state.threads()
         for board in self.monitoring_boards:
-            timestamp = self._get_day()
-            boardfolderpath = (
-                self._base_save_path / "saves" / timestamp / "threads_on_boards"
+            board_monitors = self._load_board_monitors(
+                board, stored_boards, stored_threads
             )
-            boardfolderpath.mkdir(parents=True, exist_ok=True)
-            threadpath = self._base_save_path / "saves" / timestamp / "threads" / board
-            threadpath.mkdir(parents=True, exist_ok=True)
+            if board_monitors is not None:
+                old_monitor_dict[board] = board_monitors
+                old_threads += len(board_monitors)
 
-            good_boardpath_found = False
-            for boardpath in boardfolderpath.iterdir():
-                if boardpath.name.split("_")[0] == str(board):
-                    good_boardpath = boardpath
-                    good_boardpath_found = True
+        self.monitoring_threads = old_monitor_dict
+        self._logger.debug(
+            f"{old_threads} past captures of old threads in previous instances discovered"
+        )
 
-            if not good_boardpath_found:
-                self._logger.info(
-                    f"No previous thread information for /{board}/, no old threads to monitor"
-                )
-                continue
-            old_monitor_dict[board] = {}
-
-            with open(good_boardpath, "r") as prev_threads_file:
-                prev_threads = json.load(prev_threads_file)
-                for page in prev_threads:
-                    for threads in page["threads"]:
-                        old_monitor_dict[str(board)][str(threads["no"])] = [
-                            int(threads["last_modified"]),
-                            int(threads["replies"]),
-                        ]
-                        old_threads += 1
+    def _load_board_monitors(
+        self, board: str, stored_boards: dict, stored_threads: dict
+    ):
+        if board in stored_threads:
+            board_monitors = self._restore_board_state(
+                board, stored_boards.get(board), stored_threads[board]
+            )
             self._logger.debug(
-                f"{len} past captures of old threads in previous instances of {board} discovered"
+                f"{len(board_monitors)} threads of {board} restored from the state store"
             )
+            return board_monitors
 
-        self.monitoring_threads = old_monitor_dict
+        good_boardpath = self._latest_threadlist(board)
+        if good_boardpath is None:
+            self._logger.info(
+                f"No previous thread information for /{board}/, no old threads to monitor"
+            )
+            return None
+        board_monitors = {}
+
+        with open(good_boardpath, "r") as prev_threads_file:
+            prev_threads = json.load(prev_threads_file)
+            for page in prev_threads:
+                for threads in page["threads"]:
+                    board_monitors[str(threads["no"])] = [
+                        int(threads["last_modified"]),
+                        int(threads["replies"]),
+                    ]
         self._logger.debug(
-            f"{old_threads} past captures of old threads in previous instances discovered"
+            f"{len(board_monitors)} past captures of old threads in previous instances of {board} discovered"
         )
+        return board_monitors
+
+    def _latest_threadlist(self, board: str):
+        # The thread list saved most recently, looking back through earlier
+        # days when there is none for today yet.
+        saves = self._base_save_path / "saves"
+        today = self._get_day()
+        days = [today]
+        if saves.is_dir():
+            days.extend(
+                sorted(
+                    (
+                        path.name
+                        for path in saves.iterdir()
+                        if path.is_dir() and path.name < today
+                    ),
+                    reverse=True,
+                )
+            )
+        for day in days:
+            folder = saves / day / "threads_on_boards"
+            if day != today and not folder.is_dir():
+                continue
+            threadlist = self._file_index.get(folder, board, ".json")
+            if threadlist is not None:
+                return threadlist
+        return None
+
+    def _restore_board_state(self, board: str, stored_board, stored_threads: dict):
+        threads = {}
+        validators = {}
+        fully_captured = True
+        for no, row in stored_threads.items():
+            if row["captured"] is None:
+                fully_captured = False
+                continue
+            threads[no] = [int(row["last_modified"] or 0), int(row["replies"] or 0)]
+            if row["http_last_modified"] is not None:
+                validators[no] = row["http_last_modified"]
+            self._scheduler.mark_captured(
+                board, no, threads[no][1], now=row["captured"]
+            )
+        board_validator = None
+        if stored_board is not None:
+            board_validator, self._board_requested[board] = stored_board
+        if not fully_captured:
+            # Threads listed but never captured before shutting down only show
+            # up again if the thread list is fetched in full.
+            board_validator = None
+        self._last_requested[board] = {"board": board_validator, "threads": validators}
+        return threads
 
     def set_include_exclude_boards(
         self, include_boards: list = None, exclude_boards: bool = False
@@ -120,14 +374,53 @@ class requester:
     def _update_monitoring_boards(self):
         self._logger.debug("Updating monitor board list (checking)")
         if self._include_boards is not None and not self._exclude_boards:
-            self.monitoring_boards = self._include_boards
+            if not self._board_info:
+                self._set_board_list()
+            self._candidate_boards = self._include_boards
         elif self._include_boards is not None and self._exclude_boards:
-            self.monitoring_boards = list(
+            self._candidate_boards = list(
                 set(self._set_board_list()).difference(self._include_boards)
             )
         else:
-            self.monitoring_boards = self._set_board_list()
+            self._candidate_boards = self._set_board_list()
         self._check_new_boards = False
+        self._apply_shard()
+
+    def _apply_shard(self):
+        if self._shard is None:
+            self.monitoring_boards = self._candidate_boards
+            return
+        assigned = self._shard.assign(self._candidate_boards)
+        gained = set(assigned).difference(self.monitoring_boards)
+        lost = set(self.monitoring_boards).difference(assigned)
+        self.monitoring_boards = assigned
+        if not gained and not lost:
+            return
+        self._logger.info(
+            f"Board assignment changed for {self._shard.worker_id} with workers {self._shard.workers()}: gained {sorted(gained)}, lost {sorted(lost)}"
+        )
+        for board in lost:
+            self.monitoring_threads.pop(board, None)
+            self._last_requested.pop(board, None)
+            self._scheduler.forget_board(board)
+            self._cadence.forget(board)
+        if not self.monitoring_threads:
+            # Still starting up, _load_old_monitors restores every board.
+            return
+        # Gained boards are restored from this host's state store, which holds
+        # them if they were last monitored by a worker sharing this data
+        # directory. Boards coming from a worker on another host start cold.
+        stored_boards = self._state.boards()
+        saves = self._base_save_path / "saves" / self._get_day()
+        # Another worker may have written to these boards' folders.
+        self._file_index.invalidate(saves / "threads_on_boards")
+        for board in gained:
+            self._file_index.invalidate(saves / "threads" / board)
+            board_monitors = self._load_board_monitors(
+                board, stored_boards, self._state.threads(board)
+            )
+            if board_monitors is not None:
+                self.monitoring_threads[board] = board_monitors
 
     def _begin_monitoring(self):
         self._logger.debug("_begin_monitoring entered")
@@ -135,104 +428,321 @@ class requester:
         self._logger.debug("Old monitors retrieved")
         while self.monitor is True:
             self._logger.debug("Started loop")
-            if self._check_new_boards:
-                self._logger.debug("Started updating monitoring boards")
-                self._update_monitoring_boards()
-            self._update_monitoring_threads()
+            pass_started = time.monotonic()
+            self._retain_todays_files()
+            with self.metrics.timer("fourtct_phase_seconds", phase="boards"):
+                if self._check_new_boards:
+                    self._logger.debug("Started updating monitoring boards")
+                    self._update_monitoring_boards()
+                elif self._shard is not None:
+                    self._apply_shard()
+            with self.metrics.timer("fourtct_phase_seconds", phase="threadlists"):
+                self._update_monitoring_threads()
             self._logger.debug("updating posts on monitoring list")
-            self._update_posts_on_monitoring_threadlist()
+            with self.metrics.timer("fourtct_phase_seconds", phase="threads"):
+                self._update_posts_on_monitoring_threadlist()
+            self.metrics.observe(
+                "fourtct_phase_seconds", time.monotonic() - pass_started, phase="pass"
+            )
             self._logger.debug("Ended loop")
+            self._wait_for_boards()
+
+    def _retain_todays_files(self):
+        # Once the day changes nothing new is written to the folders of past
+        # days, so they are dropped from the file index, and the segments of
+        # this worker's boards are compacted by the writers.
+        day = self._get_day()
+        if day == self._indexed_day:
+            return
+        if self._storage == "segment":
+            segments = self._base_save_path / "saves" / self._indexed_day / "segments"
+            for board in self.monitoring_boards:
+                self._persist(
+                    ("segment", board),
+                    self._segment_store.compact,
+                    segments / (board + ".seg"),
+                )
+        dropped = self._file_index.retain(self._base_save_path / "saves" / day)
+        self._indexed_day = day
+        self._logger.debug(
+            "New day %s, dropped %s folders from the file index", day, dropped
+        )
+
+    def _wait_for_boards(self):
+        # With no thread waiting to be captured there is nothing to do until
+        # the next board is due a poll.
+        wait = self._cadence.next_due(self.monitoring_boards)
+        if len(self._scheduler) or wait <= 0:
+            return
+        self._logger.debug("No board due a poll for %.1fs, waiting", wait)
+        waited_until = time.monotonic() + wait
+        while self.monitor is True and time.monotonic() < waited_until:
+            time.sleep(min(1, waited_until - time.monotonic()))
 
     def _update_monitoring_threads(self):
         self._logger.info("Beginning search for threads to monitor")
-        self._posts_to_update = []
         death_count = 0
         birth_count = 0
         update_count = 0
-        for board in self.monitoring_boards:
+        catalog_count = 0
+        due = self._cadence.due(self.monitoring_boards)
+        for board in due:
             self._logger.info(f"Searching for threads in {board}")
             threads_json = self.get_and_save_single_board_threadlist(
                 board, with_return=True
             )
             if threads_json is None:
+                self._observe_board_poll(board, 0)
                 continue
             threads_on_board = {}
-            for page in threads_json:
+            pages_on_board = {}
+            catalog_entries = {}
+            for page_number, page in enumerate(threads_json, start=1):
                 for thread in page["threads"]:
                     threads_on_board[str(thread["no"])] = [
                         int(thread["last_modified"]),
                         int(thread["replies"]),
                     ]
+                    pages_on_board[str(thread["no"])] = page_number
+                    if self._use_catalog:
+                        catalog_entries[str(thread["no"])] = thread
+            board_info = self._board_info.get(board, {})
+            pages = board_info.get("pages", max(len(threads_json), 1))
+            bump_limit = board_info.get("bump_limit", 300)
+
+            if board not in self.monitoring_threads:
+                self._logger.debug("New Board: updated to monitor list %s", board)
+                self.monitoring_threads[board] = {}
 
-            if board in self.monitoring_threads:
-                for thread in self.monitoring_threads[board]:
-                    if thread in threads_on_board:
-                        pass
-                    else:
-                        self._logger.debug(f"Thread died: /{board}/{thread}")
-                        death_count += 1
-                        if thread in self._last_requested[board]["threads"]:
-                            del self._last_requested[board]["threads"][thread]
-
-                for thread in threads_on_board:
-                    if thread in self.monitoring_threads[board]:
-                        if (
-                            self.monitoring_threads[board][thread][0]
-                            < threads_on_board[thread][0]
-                        ):
-                            self._logger.debug(f"Thread updated: /{board}/{thread}")
-                            self.monitoring_threads[board][thread] = threads_on_board[
-                                thread
-                            ]
-                            self._posts_to_update.append([board, thread])
-                            update_count += 1
-                        else:
-                            self._logger.debug(
-                                f"Do not need to update thread /{board}/{thread}"
+            board_deaths = 0
+            for thread in list(self.monitoring_threads[board]):
+                if thread not in threads_on_board:
+                    self._logger.debug("Thread died: /%s/%s", board, thread)
+                    board_deaths += 1
+                    del self.monitoring_threads[board][thread]
+                    self._scheduler.forget(board, thread)
+                    # Threads of boards without an archive are pruned when they
+                    # leave the board, so a final request could only 404.
+                    final_capture = self._final_captures and board_info.get(
+                        "is_archived"
+                    )
+                    if self._stream is not None and not final_capture:
+                        self._stream.forget(board, thread)
+                    if final_capture:
+                        self._dying.append(
+                            (
+                                board,
+                                thread,
+                                self._last_requested[board]["threads"].get(thread),
                             )
-                    else:
-                        self._logger.debug(f"New thread: /{board}/{thread}")
-                        self.monitoring_threads[board][thread] = threads_on_board[
-                            thread
-                        ]
-                        self._posts_to_update.append([board, thread])
-                        birth_count += 1
-            else:
-                self._logger.debug(f"New Board: updated to monitor list {board}")
-                self.monitoring_threads[board] = threads_on_board
-                for thread in threads_on_board:
-                    self._logger.debug(f"New thread: /{board}/{thread}")
-                    self._posts_to_update.append([board, thread])
+                        )
+                    if thread in self._last_requested[board]["threads"]:
+                        del self._last_requested[board]["threads"][thread]
+            death_count += board_deaths
+            self._observe_board_poll(board, board_deaths)
+            self._state.set_board_threads(board, threads_on_board)
+
+            for thread in threads_on_board:
+                previous_replies = None
+                if thread in self.monitoring_threads[board]:
+                    if (
+                        self.monitoring_threads[board][thread][0]
+                        >= threads_on_board[thread][0]
+                    ):
+                        self._logger.debug(
+                            "Do not need to update thread /%s/%s", board, thread
+                        )
+                        continue
+                    self._logger.debug("Thread updated: /%s/%s", board, thread)
+                    update_count += 1
+                    previous_replies = self.monitoring_threads[board][thread][1]
+                else:
+                    self._logger.debug("New thread: /%s/%s", board, thread)
                     birth_count += 1
+                self.monitoring_threads[board][thread] = threads_on_board[thread]
+                if thread in catalog_entries and self._capture_from_catalog(
+                    board, thread, catalog_entries[thread], previous_replies
+                ):
+                    self._logger.debug(
+                        "New posts of /%s/%s saved from the catalog", board, thread
+                    )
+                    self._scheduler.mark_captured(
+                        board, thread, threads_on_board[thread][1]
+                    )
+                    catalog_count += 1
+                    self.metrics.inc("fourtct_captures_total", source="catalog")
+                    continue
+                self._scheduler.observe(
+                    board,
+                    thread,
+                    threads_on_board[thread][1],
+                    pages_on_board[thread],
+                    pages=pages,
+                    bump_limit=bump_limit,
+                )
 
+        intervals = self._cadence.intervals()
+        if intervals:
+            ordered = sorted(intervals.values())
+            self._logger.info(
+                f"Polled {len(due)} of {len(self.monitoring_boards)} boards, polling intervals: min {ordered[0]:.0f}s, median {ordered[len(ordered) // 2]:.0f}s, max {ordered[-1]:.0f}s"
+            )
         self._logger.info(f"Thread deaths in previous iteration: {death_count}")
         self._logger.info(f"Thread births in previous iteration: {birth_count}")
         self._logger.info(f"Thread updates in previous iteration: {update_count}")
+        if self._use_catalog:
+            self._logger.info(
+                f"Thread updates saved from the catalog without a thread request: {catalog_count}"
+            )
+        monitored = sum(len(threads) for threads in self.monitoring_threads.values())
+        self.metrics.set("fourtct_threads_monitored", monitored)
+        self.metrics.set("fourtct_queue_depth", len(self._scheduler))
+        self.metrics.set("fourtct_dying_queue_depth", len(self._dying))
         self._logger.info(
-            f"{len(self.monitoring_threads[board])} threads found to monitor."
+            f"{monitored} threads found to monitor, {len(self._scheduler)} queued for capture, {len(self._dying)} waiting for a final capture."
         )
 
     def _update_posts_on_monitoring_threadlist(self):
-        number_posts_in_iteration = len(self._posts_to_update)
+        # Threads are popped from the scheduler in order of expected loss and
+        # fetched by a small pool of workers, so that one worker's parsing and
+        # saving overlaps with the next worker's rate limit wait. The shared
+        # token bucket keeps the overall request rate exact. Once every live
+        # thread is captured, up to ``final_captures`` threads that left their
+        # board are requested one last time.
+        number_posts_in_iteration = len(self._scheduler)
+        final_budget = self._final_captures
         i = 1
-        prev_board = ""
-        for board, post in self._posts_to_update:
-            if prev_board != board:
-                self._logger.info(f"Updating posts in {board}")
-                prev_board = board
-            start_time = time.time()
-            self.get_and_save_thread(board, post)
-            current_time_diff = (time.time() - start_time) * (
-                number_posts_in_iteration - i
+        start_time = time.time()
+        self._capture_interval = None
+        self._last_completion = time.monotonic()
+        pending = {}
+        pool = self._fetch_pool
+        while self.monitor is True:
+            if len(pending) >= 2 * self._fetch_workers:
+                i = self._collect_finished_threads(
+                    pending, i, number_posts_in_iteration, start_time
+                )
+            next_thread = self._scheduler.pop()
+            since = None
+            if next_thread is None:
+                if not self._dying or final_budget <= 0:
+                    break
+                final_budget -= 1
+                board, post, since = self._dying.popleft()
+            else:
+                board, post = next_thread
+            if self._shard is not None and not self._shard.owns(board):
+                self._logger.debug(
+                    "Skipping /%s/%s: board now belongs to another worker",
+                    board,
+                    post,
+                )
+                continue
+            if next_thread is None:
+                future = pool.submit(self.capture_final_thread, board, post, since)
+            else:
+                future = pool.submit(self.get_and_save_thread, board, post)
+            pending[future] = (board, post)
+        while pending:
+            i = self._collect_finished_threads(
+                pending, i, number_posts_in_iteration, start_time
             )
+        if number_posts_in_iteration:
+            self._scheduler.horizon = time.time() - start_time
+        self._delta_store.forget_idle(max(2 * self._scheduler.horizon, 3600))
+        self._log_staleness()
+
+    def _collect_finished_threads(
+        self, pending: dict, i: int, number_posts_in_iteration: int, start_time: float
+    ):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            board, post = pending.pop(future)
+            future.result()
+            if post in self.monitoring_threads.get(board, {}):
+                self._scheduler.mark_captured(
+                    board, post, self.monitoring_threads[board][post][1]
+                )
+            remaining = self._capture_eta(len(self._scheduler) + len(pending))
             self._logger.debug(
-                f"{i}/{number_posts_in_iteration}: Capturing post {post} in /{board}/ approximate seconds remaining in iteration {current_time_diff:n}"
+                "%s/%s: Capturing post %s in /%s/ approximate seconds remaining in iteration %.0f",
+                i,
+                number_posts_in_iteration,
+                post,
+                board,
+                remaining,
             )
             i += 1
+        return i
+
+    def _capture_eta(self, queued: int):
+        # The time between completed captures is smoothed over recent captures
+        # rather than averaged over the pass, so the estimate follows changes
+        # in response times, and can never beat the rate limit.
+        now = time.monotonic()
+        interval = now - self._last_completion
+        self._last_completion = now
+        if self._capture_interval is None:
+            self._capture_interval = interval
+        else:
+            self._capture_interval += 0.2 * (interval - self._capture_interval)
+        remaining = queued * max(self._capture_interval, self._request_time_limit)
+        self.metrics.set("fourtct_queue_depth", queued)
+        self.metrics.set("fourtct_capture_eta_seconds", remaining)
+        return remaining
+
+    def _observe_board_poll(self, board: str, deaths: int):
+        validator = self._last_requested.get(board, {}).get("board")
+        last_modified = None
+        if validator is not None:
+            try:
+                last_modified = parsedate_to_datetime(validator).timestamp()
+            except (TypeError, ValueError):
+                pass
+        interval = self._cadence.observe(
+            board,
+            last_modified,
+            deaths,
+            self._board_info.get(board, {}).get("per_page", 15),
+        )
+        self.metrics.set("fourtct_board_poll_interval_seconds", interval, board=board)
+        self._logger.debug("Next poll of /%s/ in %.0fs", board, interval)
+
+    def board_poll_intervals(self):
+        """Seconds between thread list polls currently used for each board."""
+        return self._cadence.intervals()
+
+    def thread_staleness(self):
+        """Seconds since each monitored thread was last captured, keyed by (board, thread)."""
+        return self._scheduler.staleness()
+
+    def _log_staleness(self):
+        staleness = self.thread_staleness()
+        if not staleness:
+            return
+        ordered = sorted(staleness.items(), key=lambda item: item[1], reverse=True)
+        self.metrics.set("fourtct_staleness_seconds", ordered[0][1], statistic="max")
+        self.metrics.set(
+            "fourtct_staleness_seconds",
+            ordered[len(ordered) // 2][1],
+            statistic="median",
+        )
+        self._logger.info(
+            f"Thread staleness: max {ordered[0][1]:.0f}s, median {ordered[len(ordered) // 2][1]:.0f}s over {len(ordered)} threads"
+        )
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        for (board, thread), seconds in ordered:
+            self._logger.debug(
+                "Staleness of /%s/%s: %.0fs since last capture", board, thread, seconds
+            )
 
     def _set_board_list(self):
         boards_info = self.get_chan_info_json()
-        codes = [board["board"] for board in boards_info["boards"]]
+        codes = []
+        for board in boards_info["boards"]:
+            codes.append(board["board"])
+            self._board_info[board["board"]] = board
         return codes
 
     @staticmethod
@@ -251,81 +761,109 @@ class requester:
         return now.strftime("%Y_%m_%d_%H_%M_%S")
 
     def _check_time_and_wait(self):
-        if self.last_request is None:
-            self.last_request = time.time()
-        else:
-            if time.time() - self.last_request >= self._request_time_limit:
-                self.last_request = time.time()
-            else:
-                time.sleep(self._request_time_limit - (time.time() - self.last_request))
-                self.last_request = time.time()
+        waited = self._rate_limiter.acquire()
+        self.metrics.inc("fourtct_rate_limit_wait_seconds_total", waited)
+        self.last_request = time.time()
 
-    def get_chan_info_json(self):
+    def _get_session(self):
+        # One keep-alive session per fetch worker, reused for every request
+        # that worker makes instead of opening a new TCP/TLS connection.
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2, max_retries=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions.session = session
+        return session
+
+    @staticmethod
+    def _endpoint(url: str):
+        if "/thread/" in url:
+            return "thread"
+        return url.rsplit("/", 1)[-1].removesuffix(".json")
+
+    def _get(self, url: str, headers: dict = None):
         self._check_time_and_wait()
+        endpoint = self._endpoint(url)
+        started = time.monotonic()
+        response = self._get_session().get(url, headers=headers)
+        self.metrics.observe(
+            "fourtct_request_seconds", time.monotonic() - started, endpoint=endpoint
+        )
+        self.metrics.inc(
+            "fourtct_responses_total", endpoint=endpoint, status=response.status_code
+        )
+        return response
+
+    def _count_write(self, kind: str, written: int):
+        self.metrics.inc("fourtct_bytes_written_total", written, kind=kind)
+        self.metrics.inc("fourtct_files_touched_total", kind=kind)
+
+    def get_chan_info_json(self):
         self._logger.debug("chan information requested")
-        r_boards = requests.get("http://a.4cdn.org/boards.json")
+        r_boards = self._get(self._api_base + "/boards.json")
         return r_boards.json()
 
     @staticmethod
-    def _format_if_mod_since_header(since):
-        since = time.gmtime(time.mktime(since))
-        return {"If-Modified-Since": time.strftime("%a, %d %b %Y %H:%M:%S GMT", since)}
+    def _format_if_mod_since_header(since: str):
+        if since is None:
+            return None
+        return {"If-Modified-Since": since}
+
+    @staticmethod
+    def _get_last_modified(response):
+        # Validators are the server's own Last-Modified values, echoed back
+        # verbatim, rather than our local clock.
+        return response.headers.get("Last-Modified", formatdate(usegmt=True))
 
     def get_single_board_threadlist(self, board_code: str):
-        self._check_time_and_wait()
-        self._logger.debug(f"Board /{board_code}/ thread information requested")
+        self._logger.debug("Board /%s/ thread information requested", board_code)
         if board_code not in self._last_requested:
-            self._last_requested[board_code] = {}
-            self._last_requested[board_code]["threads"] = {}
-            r_thread_list = requests.get(
-                "https://a.4cdn.org/" + board_code + "/threads.json"
-            )
-        else:
-            board_request_time = datetime.now() - datetime.fromtimestamp(
-                time.mktime(self._last_requested[board_code]["board"])
-            )
-            if board_request_time < timedelta(seconds=10):
-                sleeping = 10 - board_request_time.total_seconds()
+            self._last_requested[board_code] = {"board": None, "threads": {}}
+        if board_code in self._board_requested:
+            board_request_time = time.time() - self._board_requested[board_code]
+            if board_request_time < self._board_interval:
+                sleeping = self._board_interval - board_request_time
                 self._logger.info(
                     f"Sleeping for {sleeping} seconds: time between requests for threads on board {board_code} too short"
                 )
                 time.sleep(sleeping)
-            r_thread_list = requests.get(
-                "https://a.4cdn.org/" + board_code + "/threads.json",
-                headers=self._format_if_mod_since_header(
-                    self._last_requested[board_code]["board"]
-                ),
-            )
+        r_thread_list = self._get(
+            self._api_base
+            + "/"
+            + board_code
+            + ("/catalog.json" if self._use_catalog else "/threads.json"),
+            headers=self._format_if_mod_since_header(
+                self._last_requested[board_code]["board"]
+            ),
+        )
 
-        self._last_requested[board_code]["board"] = datetime.now().timetuple()
+        self._board_requested[board_code] = time.time()
         if r_thread_list.status_code == 304:
             self._logger.info(f"No new threads on board /{board_code}/")
             return None
+        self._last_requested[board_code]["board"] = self._get_last_modified(
+            r_thread_list
+        )
+        self._state.set_board(
+            board_code,
+            self._last_requested[board_code]["board"],
+            self._board_requested[board_code],
+        )
         return r_thread_list.json()
 
-    def get_thread(self, board_code: str, op_ID: int):
-        self._check_time_and_wait()
-        if board_code not in self._last_requested[board_code]["threads"]:
-            r_thread = requests.get(
-                "https://a.4cdn.org/" + board_code + "/thread/" + str(op_ID) + ".json"
-            )
-        else:
-            r_thread = requests.get(
-                "https://a.4cdn.org/" + board_code + "/thread/" + str(op_ID) + ".json",
-                headers=self._format_if_mod_since_header(
-                    self._last_requested[board_code]["threads"][op_ID]
-                ),
-            )
-        self._last_requested[board_code]["threads"][op_ID] = datetime.now().timetuple()
+    def _request_thread(self, board_code: str, op_ID: str, since: str = None):
+        # Requests a thread, repeating requests that fail with anything but a
+        # 200, 304 or 404, and returns the response or None if it kept failing.
+        r_thread = self._get(
+            self._api_base + "/" + board_code + "/thread/" + op_ID + ".json",
+            headers=self._format_if_mod_since_header(since),
+        )
 
         countdown = 1
-        while r_thread.status_code not in [200, 304]:
-            if r_thread.status_code == 404:
-                self._logger.warning(
-                    f"Request for thread {op_ID} on board /{board_code}/ was unsuccessful with error code {r_thread.status_code}, skipping"
-                )
-                return None
-            elif countdown < 6:
+        while r_thread.status_code not in [200, 304, 404]:
+            if countdown < 6:
                 self._logger.error(
                     f"Request for thread {op_ID} on board /{board_code}/ was unsuccessful with error code {r_thread.status_code}, trying {countdown} more times"
                 )
@@ -335,23 +873,45 @@ class requester:
                 )
                 return None
             time.sleep(self._request_time_limit * 5)
-            r_thread = requests.get(
-                "https://a.4cdn.org/" + board_code + "/thread/" + str(op_ID) + ".json",
-                headers=self._format_if_mod_since_header(
-                    self._last_requested[board_code]["threads"][op_ID]
-                ),
+            self.metrics.inc("fourtct_retries_total", endpoint="thread")
+            r_thread = self._get(
+                self._api_base + "/" + board_code + "/thread/" + op_ID + ".json",
+                headers=self._format_if_mod_since_header(since),
             )
-            self._last_requested[board_code]["threads"][
-                op_ID
-            ] = datetime.now().timetuple()
             countdown += 1
-        if r_thread.status_code == 304:
-            self._logger.debug(f"Thread {op_ID} not updated since last request")
+        return r_thread
+
+    def get_thread(self, board_code: str, op_ID: int):
+        r_thread = self._fetch_thread(board_code, op_ID)
+        if r_thread is None or r_thread.status_code != 200:
+            return None
+        return r_thread.json()
+
+    def _fetch_thread(self, board_code: str, op_ID: int):
+        # Requests a thread under the validator of its last capture, logging
+        # 304s at debug and failures as warnings, and returns the response or
+        # None if the request kept failing.
+        op_ID = str(op_ID)
+        threads_requested = self._last_requested.setdefault(
+            board_code, {"board": None, "threads": {}}
+        )["threads"]
+        r_thread = self._request_thread(
+            board_code, op_ID, threads_requested.get(op_ID)
+        )
+        if r_thread is None:
             return None
+        if r_thread.status_code == 404:
+            self._logger.warning(
+                f"Request for thread {op_ID} on board /{board_code}/ was unsuccessful with error code {r_thread.status_code}, skipping"
+            )
+            return r_thread
+        if r_thread.status_code == 304:
+            self._logger.debug("Thread %s not updated since last request", op_ID)
+            return r_thread
         elif r_thread.status_code == 200:
             self._logger.debug("Recieved answer")
-        time.sleep(self._request_time_limit)
-        return r_thread.json()
+        threads_requested[op_ID] = self._get_last_modified(r_thread)
+        return r_thread
 
     def get_and_save_chan_info(self, outpath: Path = None, filename: str = None):
         timestamp = self._get_day()
@@ -361,7 +921,8 @@ class requester:
             filename = "boards.json"
         outpath.mkdir(parents=True, exist_ok=True)
         with open(outpath / filename, "w") as outfile:
-            json.dump(self.get_chan_info_json(), outfile, indent=2)
+            written = outfile.write(json.dumps(self.get_chan_info_json(), indent=2))
+        self._count_write("boards", written)
 
     def get_and_save_single_board_threadlist(
         self,
@@ -375,64 +936,443 @@ class requester:
             outpath = self._base_save_path / "saves" / timestamp / "threads_on_boards"
         if filename is None:
             filename = board_code + self._get_time() + ".json"
-        outpath.mkdir(parents=True, exist_ok=True)
         threadlist = self.get_single_board_threadlist(board_code)
         if threadlist is None:
             return None
-        for threads in outpath.iterdir():
-            if threads.name.split("_")[0] == str(board_code):
-                threads.unlink()
-        with open(outpath / filename, "w") as outfile:
-            json.dump(threadlist, outfile, indent=2)
+        if self._use_catalog:
+            # Only the thread list is kept, as threads.json would give it.
+            to_save = [
+                {
+                    "page": page["page"],
+                    "threads": [
+                        {key: thread[key] for key in ("no", "last_modified", "replies")}
+                        for thread in page["threads"]
+                    ],
+                }
+                for page in threadlist
+            ]
+        else:
+            to_save = threadlist
+        self._persist(
+            ("threadlist", board_code),
+            self._write_threadlist,
+            board_code,
+            to_save,
+            outpath / filename,
+        )
         if with_return:
             return threadlist
 
+    def _write_threadlist(self, board_code: str, threadlist: list, path: Path):
+        self._file_index.ensure_folder(path.parent)
+        previous = self._file_index.get(path.parent, board_code, ".json")
+        if previous is not None and previous != path:
+            previous.unlink(missing_ok=True)
+            self._file_index.remove(previous)
+        with open(path, "w") as outfile:
+            written = outfile.write(json.dumps(threadlist, indent=2))
+        self._file_index.add(path)
+        self._count_write("threadlist", written)
+        return [path]
+
+    def _persist(self, key, function, *args):
+        # Hands a write to the write-behind stage while monitoring, where
+        # writes with the same key keep their order; otherwise writes inline.
+        if self._writer is None:
+            function(*args)
+        else:
+            self._writer.submit(key, partial(function, *args))
+
     def get_and_save_thread(
         self, board_code: str, op_ID: int, outpath: Path = None, filename: str = None
     ):
+        r_thread = self._fetch_thread(board_code, op_ID)
+        if r_thread is None or r_thread.status_code != 200:
+            # Unchanged since the last capture, or a failure already logged
+            # with its status.
+            return
+        self.save_thread(board_code, op_ID, r_thread.json(), outpath, filename)
+        self.metrics.inc("fourtct_captures_total", source="thread")
+
+    def capture_final_thread(self, board_code: str, op_ID: int, since: str = None):
+        """Request a thread that has left its board once more and store its final state.
+
+        Threads on boards with an archive are still served, marked ``archived``,
+        after they drop off the board. ``since`` is the validator of our last
+        capture, so an unchanged thread costs a 304. Returns whether the final
+        state is now held.
+        """
+        op_ID = str(op_ID)
+        try:
+            r_thread = self._request_thread(board_code, op_ID, since)
+            if r_thread is None:
+                return False
+            if r_thread.status_code == 404:
+                self._logger.debug(
+                    "Thread %s on /%s/ is gone, no final capture", op_ID, board_code
+                )
+                return False
+            if r_thread.status_code == 304:
+                self._state.set_final_capture(board_code, op_ID, time.time())
+                return True
+            self.save_thread(board_code, op_ID, r_thread.json(), final=True)
+            self.metrics.inc("fourtct_captures_total", source="final")
+            return True
+        finally:
+            if self._stream is not None:
+                self._stream.forget(board_code, op_ID)
+
+    def backfill_archive(self, boards: list = None):
+        """Capture the archived threads of ``boards`` we do not hold in their final state.
+
+        Walks ``/<board>/archive.json`` of every board (by default the boards
+        selected for monitoring) that has an archive, and returns the number of
+        threads captured.
+        """
+        if boards is None:
+            self._update_monitoring_boards()
+            boards = self.monitoring_boards
+        elif not self._board_info:
+            self._set_board_list()
+        captured = 0
+        with ThreadPoolExecutor(
+            max_workers=self._fetch_workers, thread_name_prefix="fetch"
+        ) as pool:
+            for board in boards:
+                if not self._board_info.get(board, {}).get("is_archived"):
+                    self._logger.info(f"/{board}/ has no archive, skipping")
+                    continue
+                r_archive = self._get(self._api_base + "/" + board + "/archive.json")
+                if r_archive.status_code != 200:
+                    self._logger.warning(
+                        f"Request for the archive of /{board}/ was unsuccessful with error code {r_archive.status_code}, skipping"
+                    )
+                    continue
+                archive = [str(no) for no in r_archive.json()]
+                held = self._state.final_captures(board)
+                missing = [no for no in archive if no not in held]
+                self._logger.info(
+                    f"Backfilling {len(missing)} of {len(archive)} archived threads on /{board}/"
+                )
+                captured += sum(
+                    pool.map(partial(self.capture_final_thread, board), missing)
+                )
+        return captured
+
+    def _thread_location(
+        self, board_code: str, op_ID: int, outpath: Path = None, filename: str = None
+    ):
+        # Returns the folder, the file already holding the thread (if any) and
+        # the file a new capture would be written to.
         timestamp = self._get_day()
+        if self._storage == "segment":
+            if outpath is None:
+                outpath = self._base_save_path / "saves" / timestamp / "segments"
+            self._file_index.ensure_folder(outpath)
+            return outpath, None, None
         if outpath is None:
             outpath = (
                 self._base_save_path / "saves" / timestamp / "threads" / board_code
             )
-        outpath.mkdir(parents=True, exist_ok=True)
+        self._file_index.ensure_folder(outpath)
 
+        suffix = ".jsonl" if self._storage == "delta" else ".json"
         if filename is None:
-            filename = str(op_ID) + self._get_time() + ".json"
-        fullname = outpath / filename
-        new_thread = True
-        for threads in outpath.iterdir():
-            if int(threads.name.split("_")[0]) == int(op_ID):
-                with open(threads, "r+") as outfile:
-                    try:
-                        data = json.load(outfile)
-                    except json.decoder.JSONDecodeError as jerror:
-                        self._logger.warning(
-                            f"Loading JSON file {threads} caused error {jerror}, continuing to writing new file rather than append. Board {board_code}, post {op_ID}"
-                        )
-                        continue
-                    else:
-                        to_update = self.get_thread(board_code, op_ID)
-                        if to_update is None:
-                            self._logger.warning(
-                                f"Likely 404 caused no return for, skipping | board {board_code}, post {op_ID}"
-                            )
-                            new_thread = False
-                            continue
-                        data.update(to_update)
-                        outfile.seek(0)
-                        json.dump(data, outfile, indent=2)
-                        new_thread = False
-        if new_thread is True:
-            with open(fullname, "w") as outfile:
-                json.dump(self.get_thread(board_code, op_ID), outfile, indent=2)
+            filename = str(op_ID) + self._get_time() + suffix
+        existing = self._file_index.get(outpath, op_ID, suffix)
+        return outpath, existing, outpath / filename
+
+    def save_thread(
+        self,
+        board_code: str,
+        op_ID: int,
+        thread: dict,
+        outpath: Path = None,
+        filename: str = None,
+        final: bool = False,
+    ):
+        """Store a full capture of a thread with the configured storage mode.
+
+        While monitoring the capture is written by the write-behind stage, after
+        any earlier writes of the same thread. A ``final`` capture is of a thread
+        that has left its board, and is recorded as such rather than as a
+        monitored thread. Posts not seen before are also sent to the stream.
+        """
+        if self._stream is not None:
+            self._stream.emit(board_code, op_ID, thread["posts"])
+        self._persist(
+            (board_code, str(op_ID)),
+            self._write_thread,
+            board_code,
+            op_ID,
+            thread,
+            self._capture_info(board_code, op_ID),
+            outpath,
+            filename,
+            final,
+        )
+
+    def _write_thread(
+        self,
+        board_code: str,
+        op_ID: int,
+        thread: dict,
+        capture: tuple,
+        outpath: Path = None,
+        filename: str = None,
+        final: bool = False,
+    ):
+        outpath, existing, fullname = self._thread_location(
+            board_code, op_ID, outpath, filename
+        )
+        if self._storage == "segment":
+            written = self._segment_store.append(outpath, board_code, op_ID, thread)
+            paths = [outpath / (board_code + ".seg"), outpath / (board_code + ".idx")]
+            self._logger.debug(
+                "%s compressed bytes appended to the /%s/ segment in %s",
+                written,
+                board_code,
+                outpath,
+            )
+        elif self._storage == "delta":
+            segment = existing or fullname
+            size = segment.stat().st_size if existing is not None else 0
+            base = None
+            if existing is None:
+                base = self._previous_capture(board_code, op_ID)
+            events = self._delta_store.append(segment, thread, base=base)
+            self._file_index.add(segment)
+            written = segment.stat().st_size - size
+            paths = [segment]
+            self._logger.debug("%s events appended to %s", events, segment)
+        else:
+            written, path = self._save_thread_json(
+                board_code, op_ID, thread, existing, fullname
+            )
+            paths = [path]
+        self._count_write("thread", written)
+        self._index_posts(board_code, op_ID, thread["posts"])
+        if final:
+            self._state.set_final_capture(board_code, str(op_ID), time.time())
+        else:
+            self._record_capture(
+                board_code,
+                op_ID,
+                thread,
+                capture,
+                None if fullname is None else paths[0],
+            )
+        return paths
+
+    def _previous_capture(self, board_code: str, op_ID: int):
+        # The file holding the last capture of a thread made on an earlier
+        # day, which a new day's segment continues from.
+        stored = self._state.capture_path(board_code, str(op_ID))
+        if stored is None:
+            return None
+        path = self._base_save_path / "saves" / stored
+        if path.suffix not in (".json", ".jsonl") or not path.exists():
+            return None
+        return path
+
+    def _save_thread_json(
+        self, board_code: str, op_ID: int, thread: dict, existing: Path, fullname: Path
+    ):
+        if existing is not None:
+            with open(existing, "r+") as outfile:
+                try:
+                    data = json.load(outfile)
+                except json.decoder.JSONDecodeError as jerror:
+                    self._logger.warning(
+                        f"Loading JSON file {existing} caused error {jerror}, continuing to writing new file rather than append. Board {board_code}, post {op_ID}"
+                    )
+                else:
+                    data.update(thread)
+                    outfile.seek(0)
+                    written = outfile.write(json.dumps(data, indent=2))
+                    outfile.truncate()
+                    return written, existing
+        with open(fullname, "w") as outfile:
+            written = outfile.write(json.dumps(thread, indent=2))
+        self._file_index.add(fullname)
+        return written, fullname
+
+    @staticmethod
+    def _merge_posts(stored: dict, op_post: dict, new_posts: list):
+        last_no = stored["posts"][-1]["no"]
+        stored["posts"][0] = {**stored["posts"][0], **op_post}
+        stored["posts"].extend(post for post in new_posts if post["no"] > last_no)
+        return stored
+
+    def _has_stored_capture(self, board_code: str, op_ID: int) -> bool:
+        outpath, existing, _ = self._thread_location(board_code, op_ID)
+        if self._storage == "segment":
+            return self._segment_store.has(outpath, board_code, op_ID)
+        return existing is not None
+
+    def _extend_thread(
+        self, board_code: str, op_ID: int, op_post: dict, new_posts: list
+    ) -> bool:
+        # Adds posts to the stored capture of a thread without a full capture,
+        # returning False if there is no stored capture to add them to. A
+        # capture still waiting to be written counts as not stored yet.
+        if not self._has_stored_capture(board_code, op_ID):
+            return False
+        if self._stream is not None:
+            self._stream.emit(board_code, op_ID, new_posts)
+        self._persist(
+            (board_code, str(op_ID)),
+            self._write_extension,
+            board_code,
+            op_ID,
+            op_post,
+            new_posts,
+            self._capture_info(board_code, op_ID),
+        )
+        return True
+
+    def _write_extension(
+        self,
+        board_code: str,
+        op_ID: int,
+        op_post: dict,
+        new_posts: list,
+        capture: tuple,
+    ):
+        if not self._has_stored_capture(board_code, op_ID):
+            # The day changed since the extension was queued.
+            self._logger.warning(
+                f"No capture of /{board_code}/{op_ID} to add {len(new_posts)} posts from the catalog to, skipping"
+            )
+            return []
+        outpath, existing, _ = self._thread_location(board_code, op_ID)
+        if self._storage == "segment":
+            stored = self._segment_store.read(outpath, board_code, op_ID)
+            written = self._segment_store.append(
+                outpath,
+                board_code,
+                op_ID,
+                self._merge_posts(stored, op_post, new_posts),
+            )
+            paths = [outpath / (board_code + ".seg"), outpath / (board_code + ".idx")]
+        elif self._storage == "delta":
+            size = existing.stat().st_size
+            # Keep the fields of the stored OP the catalog leaves out, as
+            # _merge_posts does for the other storage modes.
+            stored = compact_thread(existing)["posts"]
+            if stored and stored[0]["no"] == op_post["no"]:
+                op_post = {**stored[0], **op_post}
+            self._delta_store.extend(existing, [op_post, *new_posts])
+            written = existing.stat().st_size - size
+            paths = [existing]
+        else:
+            with open(existing, "r+") as outfile:
+                try:
+                    data = json.load(outfile)
+                except json.decoder.JSONDecodeError as jerror:
+                    self._logger.warning(
+                        f"Loading JSON file {existing} caused error {jerror}, {len(new_posts)} posts from the catalog not saved. Board {board_code}, post {op_ID}"
+                    )
+                    return []
+                outfile.seek(0)
+                written = outfile.write(
+                    json.dumps(self._merge_posts(data, op_post, new_posts), indent=2)
+                )
+                outfile.truncate()
+            paths = [existing]
+        self._count_write("thread", written)
+        self._index_posts(board_code, op_ID, [op_post, *new_posts])
+        self._record_capture(
+            board_code,
+            op_ID,
+            {"posts": [op_post, *new_posts]},
+            capture,
+            existing,
+        )
+        return paths
+
+    def _capture_from_catalog(
+        self, board_code: str, op_ID: str, entry: dict, previous_replies: int
+    ) -> bool:
+        """Save the new posts of a thread straight from its catalog entry if it holds all of them.
+
+        The catalog lists the OP and the last few replies of every thread. A
+        thread we have never captured is complete in it if no posts were
+        omitted; for a captured thread, the replies newer than the last post we
+        stored must account for every reply added since that capture.
+        """
+        last_replies = entry.get("last_replies", [])
+        op_post = {
+            key: value for key, value in entry.items() if key not in _CATALOG_ONLY_KEYS
+        }
+        if previous_replies is None:
+            if entry.get("omitted_posts", 0) != 0:
+                return False
+            self.save_thread(board_code, op_ID, {"posts": [op_post, *last_replies]})
+            return True
+        last_post_no = self._state.last_post_no(board_code, op_ID)
+        if last_post_no is None:
+            return False
+        new_posts = [post for post in last_replies if post["no"] > last_post_no]
+        if len(new_posts) != int(entry["replies"]) - previous_replies:
+            return False
+        return self._extend_thread(board_code, op_ID, op_post, new_posts)
+
+    def _index_posts(self, board_code: str, op_ID: int, posts: list):
+        # Runs on the writers, so indexing stays off the fetch threads.
+        if self._search is None:
+            return
+        with self.metrics.timer("fourtct_index_seconds"):
+            indexed = self._search.add_posts(board_code, op_ID, posts)
+        self.metrics.inc("fourtct_posts_indexed_total", indexed)
+
+    def _capture_info(self, board_code: str, op_ID: int):
+        # The listing and validator a capture was made under, taken when it is
+        # handed to the writers, as both may change before it is written.
+        op_ID = str(op_ID)
+        last_modified, replies = self.monitoring_threads.get(board_code, {}).get(
+            op_ID, [None, None]
+        )
+        validator = (
+            self._last_requested.get(board_code, {}).get("threads", {}).get(op_ID)
+        )
+        return last_modified, replies, validator
+
+    def _record_capture(
+        self,
+        board_code: str,
+        op_ID: int,
+        thread: dict,
+        capture: tuple = None,
+        path: Path = None,
+    ):
+        if capture is None:
+            capture = self._capture_info(board_code, op_ID)
+        last_modified, replies, validator = capture
+        if path is not None:
+            try:
+                path = path.relative_to(self._base_save_path / "saves").as_posix()
+            except ValueError:
+                # Saved outside the saves folder.
+                path = None
+        self._state.set_thread_capture(
+            board_code,
+            str(op_ID),
+            last_modified,
+            replies,
+            validator,
+            max(post["no"] for post in thread["posts"]),
+            time.time(),
+            path,
+        )
 
     def _setup_logging(self, logfolderpath: Path):
         logfolder = self._base_save_path / logfolderpath
         logfolder.mkdir(parents=True, exist_ok=True)
 
+        # Records are queued by the logging call and formatted and written by a
+        # listener thread, so the fetch and writer threads never wait on disk.
         self._logger = logging.getLogger("4chan_requester")
-        self._logger.setLevel(logging.DEBUG)
         self._log_formatter = logging.Formatter(
             "%(asctime)s - %(name)s - %(levelname)s: %(threadName)s - %(message)s"
         )
@@ -440,23 +1380,36 @@ class requester:
         self._streamlogs = logging.StreamHandler()
         self._streamlogs.setLevel(self._stream_log_level)
         self._streamlogs.setFormatter(self._log_formatter)
-        self._logger.addHandler(self._streamlogs)
+        handlers = [self._streamlogs]
 
         self._infologpath = logfolder / ("info_log" + self._get_full_time() + ".log")
-        self._infologfile = logging.FileHandler(self._infologpath)
+        self._infologfile = rotating_log_file(
+            self._infologpath,
+            self._log_max_bytes,
+            self._log_rotate_interval,
+            self._log_backups,
+        )
         self._infologfile.setLevel(logging.INFO)
         self._infologfile.setFormatter(self._log_formatter)
-        self._logger.addHandler(self._infologfile)
+        handlers.append(self._infologfile)
 
         if self._save_debuglog:
             self._debuglogpath = logfolder / (
                 "debug_log" + self._get_full_time() + ".log"
             )
-            self._debuglogfile = logging.FileHandler(self._debuglogpath)
+            self._debuglogfile = rotating_log_file(
+                self._debuglogpath,
+                self._log_max_bytes,
+                self._log_rotate_interval,
+                self._log_backups,
+            )
             self._debuglogfile.setLevel(logging.DEBUG)
             self._debuglogfile.setFormatter(self._log_formatter)
-            self._logger.addHandler(self._debuglogfile)
+            handlers.append(self._debuglogfile)
 
+        self._log_handler, self._stop_logging = setup_queue_logging(
+            self._logger, handlers, sample=self._debug_sample
+        )
         self._logger.debug("Logger Initalised")
 
 
@@ -481,7 +1434,210 @@ if __name__ == "__main__":
         action="store_true",
         help="Boolean flag - whether to exclude the flags after -b, e.g. '-b a c g sci -e' would exclude the boards /a/ /c/ /g/ and /sci/ from collection",
     )
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of fetch workers sharing the request rate limit, so that saving one thread overlaps with waiting to request the next",
+    )
+    argparser.add_argument(
+        "--writers",
+        type=int,
+        default=2,
+        help="Number of writer threads persisting captures behind the fetch workers, 0 to write inline",
+    )
+    argparser.add_argument(
+        "--write-queue",
+        type=int,
+        default=256,
+        help="Captures that may wait to be written before fetching pauses for the disk to catch up",
+    )
+    argparser.add_argument(
+        "--fsync-interval",
+        type=float,
+        default=5,
+        help="Seconds between batched fsyncs of written files, 0 to leave flushing to the operating system",
+    )
+    argparser.add_argument(
+        "-s",
+        "--storage",
+        choices=["json", "delta", "segment"],
+        default="json",
+        help="How thread captures are stored: 'json' rewrites one document per thread, 'delta' appends only new, edited and deleted posts to a JSONL segment per thread (see storage.py compact), 'segment' appends compressed captures to one segment file per board and day",
+    )
+    argparser.add_argument(
+        "-c",
+        "--compression",
+        choices=["gzip", "zstd"],
+        default="gzip",
+        help="Compression used by the 'segment' storage, zstd needs the zstandard package",
+    )
+    argparser.add_argument(
+        "--catalog",
+        action="store_true",
+        help="Read each board's catalog.json instead of threads.json, saving new posts straight from the catalog whenever it holds all of them so the thread does not need to be requested",
+    )
+    argparser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve metrics in the Prometheus text format on this port at /metrics (and as JSON at /metrics.json). With --coordinate, worker n uses this port plus n",
+    )
+    argparser.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="Address the metrics endpoint listens on, e.g. 0.0.0.0 to scrape it from outside a container",
+    )
+    argparser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=60,
+        help="Seconds between JSON snapshots of the metrics written to metrics.json in the log folder, 0 to disable",
+    )
+    argparser.add_argument(
+        "--max-board-interval",
+        type=float,
+        default=600,
+        help="Longest time between polls of a board's thread list. Each board is polled as often as it changes and its threads expire, at least 10 seconds apart",
+    )
+    argparser.add_argument(
+        "--search-index",
+        action="store_true",
+        help="Keep a full-text index of the collected posts in search.sqlite3 in the data directory, updated as threads are saved (see search.py)",
+    )
+    argparser.add_argument(
+        "--stream",
+        metavar="TARGET",
+        default=None,
+        help="Also write every newly seen post once, as a JSON line with its board and thread, to TARGET: - for stdout, unix:PATH to serve it on a Unix domain socket, or a file path (see stream.py)",
+    )
+    argparser.add_argument(
+        "--stream-buffer",
+        type=int,
+        default=10000,
+        help="Most posts held for the stream while its consumer catches up",
+    )
+    argparser.add_argument(
+        "--stream-overflow",
+        choices=["block", "drop"],
+        default="block",
+        help="When the stream buffer is full, pause capturing until the consumer catches up (block) or drop the posts from the stream (drop)",
+    )
+    argparser.add_argument(
+        "--stream-max-mb",
+        type=float,
+        default=100,
+        help="Rotate a stream file once it reaches this many megabytes, 0 for no size limit",
+    )
+    argparser.add_argument(
+        "--stream-rotate-hours",
+        type=float,
+        default=1,
+        help="Rotate a stream file once it is this many hours old, 0 to only rotate by size",
+    )
+    argparser.add_argument(
+        "--final-captures",
+        type=int,
+        default=50,
+        help="Threads that left a board with an archive to request one last time (their archived copy) in each pass, once every live thread is captured. 0 to disable",
+    )
+    argparser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Capture the archived threads of the selected boards not already held in their final state, then exit",
+    )
+    argparser.add_argument(
+        "--no-debug-log",
+        action="store_true",
+        help="Do not write the debug log, so debug messages are never built",
+    )
+    argparser.add_argument(
+        "--debug-sample",
+        type=int,
+        default=10,
+        help="Keep one in this many of each repeated debug message (after the first 20 a minute) and log how many were dropped, 1 to keep every message",
+    )
+    argparser.add_argument(
+        "--log-max-mb",
+        type=float,
+        default=100,
+        help="Rotate a log file once it reaches this many megabytes, 0 for no size limit. Rotated logs are gzipped",
+    )
+    argparser.add_argument(
+        "--log-rotate-hours",
+        type=float,
+        default=24,
+        help="Rotate a log file once it is this many hours old, 0 to only rotate by size",
+    )
+    argparser.add_argument(
+        "--log-backups",
+        type=int,
+        default=10,
+        help="Number of rotated files kept of each log",
+    )
+    argparser.add_argument(
+        "--coordinate",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Run N worker processes on this host that split the boards between them, dividing the request rate limit between them",
+    )
+    argparser.add_argument(
+        "--shard-folder",
+        default=None,
+        help="Folder through which sharded workers coordinate, shared by every worker (on any host) splitting the same boards. Defaults to the shards folder in the data directory with --coordinate",
+    )
+    argparser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Name of this worker in its shard group, defaults to the host name and process id",
+    )
     args = argparser.parse_args()
-    requester_instance = requester(
-        True, args.d, boards=args.boards, exclude_boards=args.exclude
+    if args.coordinate and args.stream in ("-", "stdout"):
+        # The workers' lines would interleave on the one stdout.
+        argparser.error("--stream - cannot be combined with --coordinate")
+    requester_kwargs = dict(
+        run_in_docker=args.d,
+        boards=args.boards,
+        exclude_boards=args.exclude,
+        fetch_workers=args.workers,
+        storage=args.storage,
+        compression=args.compression,
+        use_catalog=args.catalog,
+        metrics_port=args.metrics_port,
+        metrics_host=args.metrics_host,
+        metrics_interval=args.metrics_interval,
+        writers=args.writers,
+        write_queue=args.write_queue,
+        fsync_interval=args.fsync_interval,
+        debug_log=not args.no_debug_log,
+        debug_sample=args.debug_sample,
+        log_max_bytes=int(args.log_max_mb * 2**20),
+        log_rotate_interval=args.log_rotate_hours * 3600,
+        log_backups=args.log_backups,
+        final_captures=args.final_captures,
+        board_max_interval=args.max_board_interval,
+        search=args.search_index,
+        stream=args.stream,
+        stream_buffer=args.stream_buffer,
+        stream_overflow=args.stream_overflow,
+        stream_max_bytes=int(args.stream_max_mb * 2**20),
+        stream_rotate_interval=args.stream_rotate_hours * 3600,
     )
+    if args.backfill:
+        requester_instance = requester(False, **requester_kwargs)
+        captured = requester_instance.backfill_archive()
+        print(f"{captured} archived threads backfilled")
+    elif args.coordinate:
+        shard_folder = args.shard_folder
+        if shard_folder is None:
+            shard_folder = "/data/shards" if args.d else "data/shards"
+        run_local_workers(args.coordinate, shard_folder, requester_kwargs)
+    else:
+        if args.shard_folder is not None:
+            requester_kwargs["shard_folder"] = args.shard_folder
+            requester_kwargs["worker_id"] = args.worker_id
+            if args.worker_id is not None:
+                requester_kwargs["logfolderpath"] = str(Path("logs") / args.worker_id)
+        requester_instance = requester(True, **requester_kwargs)
@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class thread_scheduler:
+    """Priority queue of threads waiting to be captured, ranked by expected loss.
+
+    Every time a thread list is read, each changed thread is observed with the
+    fields 4chan gives us in ``threads.json``: its reply count and the page it
+    sits on, alongside the board's page count and bump limit. From these and our own capture history
+    the scheduler estimates how many posts we would lose if the thread died
+    before we got to it::
+
+        pending   = replies now - replies at our last capture
+        velocity  = smoothed replies per second between observations
+        p_death   = chance the thread falls off the board within the horizon,
+                    growing with its page position and jumping once it reaches
+                    the bump limit and can no longer be bumped
+        priority  = p_death * (pending + velocity * horizon)
+
+    ``horizon`` is the expected time until we could next reach the thread, and
+    is set by the requester to the duration of its last pass. Threads are popped
+    highest priority first, so a fixed request budget goes to the threads most
+    at risk of losing posts.
+    """
+
+    def __init__(self, horizon: float = 600, smoothing: float = 0.5):
+        self.horizon = horizon
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._observed = {}
+        self._velocity = {}
+        self._captured = {}
+        self._first_seen = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def observe(
+        self,
+        board: str,
+        thread: str,
+        replies: int,
+        page: int,
+        pages: int = 10,
+        bump_limit: int = 300,
+        now: float = None,
+    ):
+        """Record a thread list observation and (re)queue the thread."""
+        if now is None:
+            now = time.time()
+        key = (board, thread)
+        with self._lock:
+            self._first_seen.setdefault(key, now)
+            if key in self._observed:
+                prev_time, prev_replies = self._observed[key]
+                if now > prev_time:
+                    rate = max(replies - prev_replies, 0) / (now - prev_time)
+                    old_rate = self._velocity.get(key, rate)
+                    self._velocity[key] = (
+                        self._smoothing * rate + (1 - self._smoothing) * old_rate
+                    )
+            self._observed[key] = (now, replies)
+
+            priority = self._expected_loss(key, replies, page, pages, bump_limit, now)
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                old_entry[3] = False
+            entry = [-priority, next(self._counter), key, True]
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+        return priority
+
+    def _expected_loss(self, key, replies, page, pages, bump_limit, now):
+        captured_time, captured_replies = self._captured.get(
+            key, (self._first_seen[key], -1)
+        )
+        pending = max(replies - captured_replies, 0)
+        staleness = max(now - captured_time, 1)
+        velocity = self._velocity.get(key, pending / staleness)
+
+        p_death = 0.05 + (page / max(pages, 1)) ** 2
+        if replies >= bump_limit:
+            p_death += 0.5
+        p_death = min(p_death, 1)
+        return p_death * (pending + velocity * self.horizon)
+
+    def pop(self):
+        """Return the ``(board, thread)`` with the highest expected loss, or None."""
+        with self._lock:
+            while self._heap:
+                _, _, key, valid = heapq.heappop(self._heap)
+                if valid:
+                    del self._entries[key]
+                    return key
+            return None
+
+    def mark_captured(self, board: str, thread: str, replies: int, now: float = None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._captured[(board, thread)] = (now, replies)
+
+    def forget(self, board: str, thread: str):
+        """Drop all state for a thread that is no longer on its board."""
+        key = (board, thread)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                entry[3] = False
+            self._observed.pop(key, None)
+            self._velocity.pop(key, None)
+            self._captured.pop(key, None)
+            self._first_seen.pop(key, None)
+
+    def forget_board(self, board: str):
+        """Drop all state for every thread of a board we no longer monitor."""
+        with self._lock:
+            keys = [
+                key
+                for key in set(self._first_seen).union(self._captured)
+                if key[0] == board
+            ]
+        for key in keys:
+            self.forget(*key)
+
+    def staleness(self, now: float = None):
+        """Seconds since each known thread was last captured (or first seen)."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return {
+                key: now - self._captured.get(key, (first_seen, None))[0]
+                for key, first_seen in self._first_seen.items()
+            }
+
+
+class board_cadence:
+    """Learns how often each board's thread list needs to be polled.
+
+    Every poll tells us whether the board changed since the previous one: its
+    ``Last-Modified`` value moved on, or the server answered 304. The interval
+    until a board's next poll shrinks by ``speedup`` after a poll that saw a
+    change and grows by ``backoff`` after one that did not, which settles where
+    about half of all polls find something new, i.e. close to the board's own
+    time between changes. The rate at which threads fall off the board is
+    smoothed over polls and bounds the interval from above::
+
+        expiry    = threads per page / threads dying per second
+        interval  = min(change interval, safety * expiry)
+
+    so a page of threads cannot expire unseen between polls, however rarely
+    the board changes otherwise. Intervals stay within ``min_interval`` (the
+    API's minimum) and ``max_interval``. Quiet boards back off, and the
+    requests they no longer make go to the busy boards' threads.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 10,
+        max_interval: float = 600,
+        safety: float = 0.5,
+        speedup: float = 0.7,
+        backoff: float = 1.4,
+        smoothing: float = 0.3,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self._safety = safety
+        self._speedup = speedup
+        self._backoff = backoff
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self._polled = {}
+        self._last_change = {}
+        self._change_interval = {}
+        self._death_rate = {}
+        self._interval = {}
+
+    def _bound(self, interval: float) -> float:
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def observe(
+        self,
+        board: str,
+        last_modified: float = None,
+        deaths: int = 0,
+        per_page: int = 15,
+        now: float = None,
+    ):
+        """Record a poll of a board and return the interval until its next poll.
+
+        ``last_modified`` is the server's time of the board's last change and
+        ``deaths`` the number of threads that left it since the previous poll.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            previous_poll = self._polled.get(board)
+            previous_change = self._last_change.get(board)
+            self._polled[board] = now
+            if last_modified is not None:
+                self._last_change[board] = last_modified
+            changed = last_modified is not None and (
+                previous_change is None or last_modified > previous_change
+            )
+
+            interval = self._change_interval.get(board, self.min_interval)
+            if previous_poll is not None:
+                interval *= self._speedup if changed else self._backoff
+                if now > previous_poll:
+                    rate = deaths / (now - previous_poll)
+                    old_rate = self._death_rate.get(board, rate)
+                    self._death_rate[board] = (
+                        self._smoothing * rate + (1 - self._smoothing) * old_rate
+                    )
+            interval = self._change_interval[board] = self._bound(interval)
+
+            if self._death_rate.get(board):
+                interval = min(
+                    interval, self._safety * per_page / self._death_rate[board]
+                )
+            interval = self._interval[board] = self._bound(interval)
+            return interval
+
+    def due(self, boards: list, now: float = None):
+        """Return the boards of ``boards`` due a poll, most overdue first."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            overdue = []
+            for board in boards:
+                if board not in self._polled:
+                    overdue.append((float("inf"), board))
+                    continue
+                late = now - self._polled[board] - self._interval[board]
+                if late >= 0:
+                    overdue.append((late, board))
+        return [board for _, board in sorted(overdue, reverse=True)]
+
+    def next_due(self, boards: list, now: float = None) -> float:
+        """Seconds until the first of ``boards`` is due a poll."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            waits = [
+                self._polled[board] + self._interval[board] - now
+                if board in self._polled
+                else 0
+                for board in boards
+            ]
+        return max(min(waits, default=0), 0)
+
+    def intervals(self):
+        """The polling interval currently used for each board, in seconds."""
+        with self._lock:
+            return dict(self._interval)
+
+    def forget(self, board: str):
+        """Drop all state for a board we no longer monitor."""
+        with self._lock:
+            for rates in (
+                self._polled,
+                self._last_change,
+                self._change_interval,
+                self._death_rate,
+                self._interval,
+            ):
+                rates.pop(board, None)
@@ -0,0 +1,279 @@
+import argparse
+import html
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from corpus import iter_posts
+
+search_hit = namedtuple("search_hit", ["board", "thread", "no", "time", "snippet"])
+
+_BREAK = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]+>")
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def comment_text(comment: str) -> str:
+    """Plain text of a 4chan comment: line breaks kept, tags dropped, entities decoded."""
+    if not comment:
+        return ""
+    return html.unescape(_TAG.sub("", _BREAK.sub("\n", comment)))
+
+
+def _post_text(post: dict) -> str:
+    return "\n".join(
+        text
+        for text in (comment_text(post.get("sub")), comment_text(post.get("com")))
+        if text
+    )
+
+
+def _timestamp(value, end: bool = False):
+    # Dates and times as given on the command line, read as UTC. A date on its
+    # own as an ``end`` bound stands for the last second of that day.
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).replace("_", "-")
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    if end and _DATE.fullmatch(text):
+        return (moment + timedelta(days=1)).timestamp() - 1
+    return moment.timestamp()
+
+
+class search_index:
+    """Incremental full-text index of collected posts in a SQLite FTS5 database.
+
+    Every post is indexed once under its board and number, with its thread,
+    time and the text of its subject and comment stripped of HTML. Adding a
+    thread again only touches the posts that are new or whose text changed, so
+    captures can be fed in as they are saved. ``search`` takes the FTS5 query
+    syntax (terms, ``"quoted phrases"``, ``AND``/``OR``/``NOT`` and ``prefix*``)
+    and filters on board and post time.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY,
+                    board TEXT NOT NULL,
+                    thread INTEGER NOT NULL,
+                    no INTEGER NOT NULL,
+                    time INTEGER,
+                    text_hash INTEGER,
+                    UNIQUE (board, no)
+                )""")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS posts_board_time ON posts (board, time)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS posts_time ON posts (time)"
+            )
+            self._connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS post_text
+                USING fts5(text, tokenize = 'unicode61 remove_diacritics 2')""")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _add(self, board: str, thread: int, posts) -> int:
+        indexed = 0
+        for post in posts:
+            text = _post_text(post)
+            text_hash = zlib.crc32(text.encode("utf-8"))
+            row = self._connection.execute(
+                "SELECT id, text_hash FROM posts WHERE board = ? AND no = ?",
+                (board, post["no"]),
+            ).fetchone()
+            if row is not None:
+                if row[1] == text_hash:
+                    continue
+                self._connection.execute(
+                    "DELETE FROM post_text WHERE rowid = ?", (row[0],)
+                )
+                self._connection.execute(
+                    "UPDATE posts SET text_hash = ? WHERE id = ?", (text_hash, row[0])
+                )
+                post_id = row[0]
+            else:
+                post_id = self._connection.execute(
+                    """INSERT INTO posts (board, thread, no, time, text_hash)
+                    VALUES (?, ?, ?, ?, ?)""",
+                    (board, int(thread), post["no"], post.get("time"), text_hash),
+                ).lastrowid
+            self._connection.execute(
+                "INSERT INTO post_text (rowid, text) VALUES (?, ?)", (post_id, text)
+            )
+            indexed += 1
+        return indexed
+
+    def add_posts(self, board: str, thread: int, posts: list) -> int:
+        """Index the new and changed posts of a thread, returning how many were indexed."""
+        with self._lock, self._connection:
+            return self._add(board, thread, posts)
+
+    def add_records(self, records, batch: int = 10000) -> int:
+        """Index ``post_record`` tuples from the corpus reader, committing every ``batch`` posts."""
+        indexed = 0
+        pending = 0
+        with self._lock:
+            try:
+                for record in records:
+                    indexed += self._add(record.board, record.thread, [record.post])
+                    pending += 1
+                    if pending >= batch:
+                        self._connection.commit()
+                        pending = 0
+            finally:
+                self._connection.commit()
+        return indexed
+
+    def search(
+        self,
+        query: str,
+        boards: list = None,
+        since=None,
+        until=None,
+        limit: int = 50,
+    ):
+        """Return the newest posts matching ``query`` as ``search_hit`` tuples.
+
+        ``since`` and ``until`` bound the post time, as Unix times or ISO dates
+        and times in UTC. An ``until`` date includes the whole of that day.
+        """
+        sql = """SELECT posts.board, posts.thread, posts.no, posts.time,
+                snippet(post_text, 0, '[', ']', '...', 12)
+            FROM post_text JOIN posts ON posts.id = post_text.rowid
+            WHERE post_text MATCH ?"""
+        parameters = [query]
+        if boards:
+            sql += f" AND posts.board IN ({','.join('?' * len(boards))})"
+            parameters.extend(boards)
+        if since is not None:
+            sql += " AND posts.time >= ?"
+            parameters.append(_timestamp(since))
+        if until is not None:
+            sql += " AND posts.time <= ?"
+            parameters.append(_timestamp(until, end=True))
+        sql += " ORDER BY posts.time DESC LIMIT ?"
+        parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [search_hit(*row) for row in rows]
+
+
+def build_index(
+    saves: Path,
+    index: Path,
+    boards: list = None,
+    start_day=None,
+    end_day=None,
+    processes: int = None,
+):
+    """Index the posts of a saves tree, reading the captures in parallel.
+
+    Only posts that are new or changed since the index was last built are
+    written, so the index can be brought up to date by building it again.
+    Returns the number of posts indexed.
+    """
+    search = search_index(index)
+    try:
+        return search.add_records(
+            iter_posts(
+                saves,
+                boards=boards,
+                start_day=start_day,
+                end_day=end_day,
+                processes=processes,
+            )
+        )
+    finally:
+        search.close()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Full-text search over the posts in a 4TCT saves folder"
+    )
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build", help="Create or bring up to date the index of a saves folder"
+    )
+    build_parser.add_argument("saves", help="The saves folder, e.g. data/saves")
+    build_parser.add_argument(
+        "-i", "--index", default="data/search.sqlite3", help="The index file"
+    )
+    build_parser.add_argument(
+        "-b", "--boards", nargs="*", default=None, help="Only index these boards"
+    )
+    build_parser.add_argument(
+        "--start", default=None, help="First day to index, e.g. 2023_07_01"
+    )
+    build_parser.add_argument(
+        "--end", default=None, help="Last day to index, e.g. 2023_07_31"
+    )
+    build_parser.add_argument(
+        "-p", "--processes", type=int, default=None, help="Number of reader processes"
+    )
+    query_parser = subparsers.add_parser(
+        "query",
+        help='Find posts matching a query, e.g. \'"exact phrase" AND term\'',
+    )
+    query_parser.add_argument("query", help="An FTS5 query")
+    query_parser.add_argument(
+        "-i", "--index", default="data/search.sqlite3", help="The index file"
+    )
+    query_parser.add_argument(
+        "-b", "--boards", nargs="*", default=None, help="Only search these boards"
+    )
+    query_parser.add_argument(
+        "--since", default=None, help="Earliest post time, e.g. 2023-07-01"
+    )
+    query_parser.add_argument(
+        "--until", default=None, help="Latest post time, e.g. 2023-07-31T12:00"
+    )
+    query_parser.add_argument(
+        "-n", "--limit", type=int, default=50, help="Maximum number of posts returned"
+    )
+    query_parser.add_argument(
+        "--json", action="store_true", help="Write the hits as JSON lines"
+    )
+    args = argparser.parse_args()
+    if args.command == "build":
+        started = time.monotonic()
+        indexed = build_index(
+            args.saves, args.index, args.boards, args.start, args.end, args.processes
+        )
+        print(f"{indexed} posts indexed in {time.monotonic() - started:.1f}s")
+    elif args.command == "query":
+        search = search_index(args.index)
+        started = time.monotonic()
+        hits = search.search(
+            args.query, args.boards, args.since, args.until, args.limit
+        )
+        elapsed = time.monotonic() - started
+        for hit in hits:
+            if args.json:
+                sys.stdout.write(json.dumps(hit._asdict()) + "\n")
+            else:
+                posted = time.strftime("%Y-%m-%d %H:%M", time.gmtime(hit.time or 0))
+                sys.stdout.write(
+                    f"/{hit.board}/{hit.thread}#{hit.no} {posted}: {hit.snippet}\n"
+                )
+        sys.stderr.write(f"{len(hits)} posts in {elapsed * 1000:.1f}ms\n")
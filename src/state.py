@@ -0,0 +1,212 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class state_store:
+    """Durable crawl state kept in a SQLite database in the data directory.
+
+    Stores the server's ``Last-Modified`` validator for every board thread list
+    and thread, the ``threads.json`` metadata each monitored thread had when we
+    last captured it, the last post number in that capture and the file it was
+    stored in, along with the threads whose final state (after they left their
+    board) has been captured. A restarted requester reloads
+    this instead of rescanning the saves folder, so it can resume with
+    conditional requests straight away.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS boards (
+                    board TEXT PRIMARY KEY,
+                    http_last_modified TEXT,
+                    requested REAL
+                )""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS threads (
+                    board TEXT NOT NULL,
+                    no TEXT NOT NULL,
+                    last_modified INTEGER,
+                    replies INTEGER,
+                    http_last_modified TEXT,
+                    last_post_no INTEGER,
+                    captured REAL,
+                    PRIMARY KEY (board, no)
+                )""")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS final_captures (
+                    board TEXT NOT NULL,
+                    no TEXT NOT NULL,
+                    captured REAL,
+                    PRIMARY KEY (board, no)
+                )""")
+            columns = [
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(threads)")
+            ]
+            if "capture_path" not in columns:
+                # Added after the first release of the store.
+                self._connection.execute(
+                    "ALTER TABLE threads ADD COLUMN capture_path TEXT"
+                )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def set_board(self, board: str, http_last_modified: str, requested: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT INTO boards (board, http_last_modified, requested)
+                VALUES (?, ?, ?)
+                ON CONFLICT (board) DO UPDATE SET
+                    http_last_modified = excluded.http_last_modified,
+                    requested = excluded.requested""",
+                (board, http_last_modified, requested),
+            )
+
+    def boards(self):
+        """Return ``{board: (http_last_modified, requested)}``."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT board, http_last_modified, requested FROM boards"
+            ).fetchall()
+        return {
+            board: (last_modified, requested)
+            for board, last_modified, requested in rows
+        }
+
+    def set_board_threads(self, board: str, threads):
+        """Bring the stored thread list of a board in line with ``threads``.
+
+        Threads that are no longer listed are removed and newly listed threads
+        are added without capture information. The ``threads.json`` metadata of
+        a thread is only stored once it has been captured, so that threads which
+        changed since their last capture are fetched again after a restart.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS listed (no TEXT PRIMARY KEY)"
+            )
+            self._connection.execute("DELETE FROM listed")
+            self._connection.executemany(
+                "INSERT INTO listed (no) VALUES (?)", ((no,) for no in threads)
+            )
+            self._connection.execute(
+                "DELETE FROM threads WHERE board = ? AND no NOT IN (SELECT no FROM listed)",
+                (board,),
+            )
+            self._connection.execute(
+                """INSERT OR IGNORE INTO threads (board, no)
+                SELECT ?, no FROM listed""",
+                (board,),
+            )
+
+    def set_thread_capture(
+        self,
+        board: str,
+        no: str,
+        last_modified: int,
+        replies: int,
+        http_last_modified: str,
+        last_post_no: int,
+        captured: float,
+        capture_path: str = None,
+    ):
+        """Record a saved capture of a thread along with the validator it was served with.
+
+        ``capture_path`` is the file the capture is stored in, relative to the
+        saves folder, if it has a file of its own. ``last_post_no`` never goes
+        back: a capture that only updates the OP, or from which the last
+        replies were deleted, keeps the highest post number stored so far.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT INTO threads (board, no, last_modified, replies,
+                    http_last_modified, last_post_no, captured, capture_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (board, no) DO UPDATE SET
+                    last_modified = excluded.last_modified,
+                    replies = excluded.replies,
+                    http_last_modified = excluded.http_last_modified,
+                    last_post_no = MAX(
+                        COALESCE(threads.last_post_no, excluded.last_post_no),
+                        COALESCE(excluded.last_post_no, threads.last_post_no)
+                    ),
+                    captured = excluded.captured,
+                    capture_path = excluded.capture_path""",
+                (
+                    board,
+                    no,
+                    last_modified,
+                    replies,
+                    http_last_modified,
+                    last_post_no,
+                    captured,
+                    capture_path,
+                ),
+            )
+
+    def threads(self, board: str = None):
+        """Return ``{board: {no: row}}`` where each row is a dict of the stored columns."""
+        query = """SELECT board, no, last_modified, replies, http_last_modified,
+            last_post_no, captured FROM threads"""
+        parameters = ()
+        if board is not None:
+            query += " WHERE board = ?"
+            parameters = (board,)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        result = {}
+        for row in rows:
+            result.setdefault(row[0], {})[row[1]] = {
+                "last_modified": row[2],
+                "replies": row[3],
+                "http_last_modified": row[4],
+                "last_post_no": row[5],
+                "captured": row[6],
+            }
+        return result
+
+    def last_post_no(self, board: str, no: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT last_post_no FROM threads WHERE board = ? AND no = ?",
+                (board, no),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def capture_path(self, board: str, no: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT capture_path FROM threads WHERE board = ? AND no = ?",
+                (board, no),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_final_capture(self, board: str, no: str, captured: float):
+        """Record that the final state of a thread that left its board is held."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT INTO final_captures (board, no, captured) VALUES (?, ?, ?)
+                ON CONFLICT (board, no) DO UPDATE SET captured = excluded.captured""",
+                (board, no, captured),
+            )
+
+    def final_captures(self, board: str):
+        """Return the numbers of the threads of ``board`` held in their final state."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT no FROM final_captures WHERE board = ?", (board,)
+            ).fetchall()
+        return {row[0] for row in rows}
@@ -0,0 +1,847 @@
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from array import array
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _post_hash(post: dict) -> int:
+    return zlib.crc32(json.dumps(post, sort_keys=True).encode("utf-8"))
+
+
+def iter_events(path: Path):
+    """Yield the events of a thread segment in the order they were written.
+
+    A last line cut short by an interrupted write is skipped.
+    """
+    with open(path, "r") as segment:
+        for line in segment:
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
+                # A torn last line from an interrupted write.
+                return
+            yield event
+
+
+def _last_line_start(segment, end: int) -> int:
+    # Offset just past the last newline before ``end``, or 0 if there is none.
+    position = end
+    while position > 0:
+        start = max(0, position - 65536)
+        segment.seek(start)
+        newline = segment.read(position - start).rfind(b"\n")
+        if newline != -1:
+            return start + newline + 1
+        position = start
+    return 0
+
+
+def _append_events(path: Path, events: list):
+    # Appends events to a segment, one JSON line each. If an interrupted write
+    # left the last line without its newline, that line is finished off when
+    # it is complete and dropped when it is torn, so the new events never run
+    # into it.
+    with open(path, "a+b") as segment:
+        end = segment.seek(0, os.SEEK_END)
+        if end:
+            segment.seek(end - 1)
+            if segment.read(1) != b"\n":
+                start = _last_line_start(segment, end)
+                segment.seek(start)
+                try:
+                    json.loads(segment.read(end - start))
+                    segment.write(b"\n")
+                except json.decoder.JSONDecodeError:
+                    segment.truncate(start)
+        segment.write(
+            "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+        )
+
+
+def base_path(path: Path, event: dict) -> Path:
+    """Resolve the capture a ``base`` event of the segment at ``path`` refers to."""
+    return Path(path).parent / event["path"]
+
+
+def _thread_posts(path: Path) -> dict:
+    # Posts of a stored capture keyed by ``no``, following base references
+    # into the captures of earlier days.
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path, "r") as infile:
+            return {post["no"]: post for post in json.load(infile).get("posts", [])}
+    posts = {}
+    for event in iter_events(path):
+        if event["event"] in ("post", "edit"):
+            posts[event["post"]["no"]] = event["post"]
+        elif event["event"] == "delete":
+            posts.pop(event["no"], None)
+        elif event["event"] == "base":
+            posts.update(_thread_posts(base_path(path, event)))
+    return posts
+
+
+def compact_thread(path: Path) -> dict:
+    """Replay a thread segment into the document the JSON storage mode would hold.
+
+    Posts are keyed by ``no``: edits replace the stored post and deletions
+    remove it, so the result matches the latest capture of the thread. A
+    segment starting with a ``base`` event continues the capture of an earlier
+    day, which is replayed first.
+    """
+    posts = _thread_posts(path)
+    return {"posts": [posts[no] for no in sorted(posts)]}
+
+
+class file_index:
+    """In-memory map from a folder and file name prefix to the file holding it.
+
+    Saved files are named ``<prefix>_<HH_MM_SS><suffix>``, where the prefix is a
+    thread number or board code, so every lookup the requester makes is a
+    (folder, prefix, suffix) key. Each folder is listed at most once, either
+    when the index is built at startup or the first time it is used, and every
+    write updates the index, so no directory listing happens on the hot path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._folders = {}
+
+    @staticmethod
+    def _key(path: Path):
+        return path.name.split("_")[0], path.suffix
+
+    def _scan(self, folder: Path):
+        files = {}
+        if folder.is_dir():
+            # Later captures sort after earlier ones, so the newest file wins.
+            for path in sorted(folder.iterdir()):
+                if path.is_file():
+                    files[self._key(path)] = path
+        else:
+            folder.mkdir(parents=True, exist_ok=True)
+        return files
+
+    def _files(self, folder: Path):
+        files = self._folders.get(folder)
+        if files is None:
+            files = self._folders[folder] = self._scan(folder)
+        return files
+
+    def build(self, root: Path):
+        """Index every folder under ``root`` that contains files."""
+        with self._lock:
+            for folder in [root, *(path for path in root.rglob("*") if path.is_dir())]:
+                self._folders[folder] = self._scan(folder)
+
+    def ensure_folder(self, folder: Path):
+        """Create ``folder`` if needed, indexing it the first time it is seen."""
+        with self._lock:
+            self._files(folder)
+
+    def invalidate(self, folder: Path):
+        """Forget a folder another process may have written to, so it is listed again."""
+        with self._lock:
+            self._folders.pop(folder, None)
+
+    def retain(self, root: Path):
+        """Forget every folder outside ``root``, returning how many were dropped.
+
+        Called with the current day's folder when the day changes, so the index
+        only holds the files still being written to. A folder used again later
+        is listed again.
+        """
+        with self._lock:
+            stale = [
+                folder
+                for folder in self._folders
+                if folder != root and root not in folder.parents
+            ]
+            for folder in stale:
+                del self._folders[folder]
+        return len(stale)
+
+    def get(self, folder: Path, prefix: str, suffix: str):
+        with self._lock:
+            return self._files(folder).get((str(prefix), suffix))
+
+    def add(self, path: Path):
+        with self._lock:
+            self._files(path.parent)[self._key(path)] = path
+
+    def remove(self, path: Path):
+        with self._lock:
+            files = self._files(path.parent)
+            if files.get(self._key(path)) == path:
+                del files[self._key(path)]
+
+
+class delta_thread_store:
+    """Append-only storage of thread captures as JSONL event segments.
+
+    Each thread gets one segment per day, written next to where the JSON
+    storage mode would put its document. The first capture writes every post as
+    a ``post`` event; later captures only append posts whose ``no`` is newer
+    than the last stored one, plus ``edit`` events for posts whose content
+    changed and ``delete`` events for posts that disappeared. Writing a capture
+    therefore costs O(new posts) on disk instead of O(thread size).
+
+    A thread still alive when the day changes does not start from scratch in
+    the new day's folder: its first segment there opens with a ``base`` event
+    holding the relative path of the previous day's capture, and only the
+    changes since that capture follow.
+
+    To detect edits and deletions the store keeps the post numbers and a
+    content hash of every post in each open segment, loaded from the segment
+    the first time it is touched and dropped once it has been idle for a while.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {}
+        self._last_used = {}
+
+    def _load_index(self, path: Path):
+        posts = {}
+        if path.exists():
+            posts = {no: _post_hash(post) for no, post in _thread_posts(path).items()}
+        nos = array("q", sorted(posts))
+        hashes = array("I", (posts[no] for no in nos))
+        return nos, hashes
+
+    def append(
+        self, path: Path, thread: dict, captured: float = None, base: Path = None
+    ) -> int:
+        """Append the changes in ``thread`` to its segment, returning the event count.
+
+        ``base`` is an earlier capture of the thread (a segment or JSON
+        document) that a new segment continues from, so only the changes since
+        it are written.
+        """
+        if captured is None:
+            captured = time.time()
+        captured = int(captured)
+        path = Path(path)
+        with self._lock:
+            index = self._index.get(path)
+        events = []
+        if index is None:
+            if base is not None and not path.exists():
+                index = self._load_index(Path(base))
+                events.append(
+                    {
+                        "event": "base",
+                        "time": captured,
+                        "path": os.path.relpath(base, path.parent),
+                    }
+                )
+            else:
+                index = self._load_index(path)
+        nos, hashes = index
+
+        current = {post["no"]: post for post in thread["posts"]}
+        last_no = nos[-1] if nos else 0
+        new_nos = array("q")
+        new_hashes = array("I")
+        for no, stored_hash in zip(nos, hashes):
+            post = current.get(no)
+            if post is None:
+                events.append({"event": "delete", "time": captured, "no": no})
+                continue
+            post_hash = _post_hash(post)
+            if post_hash != stored_hash:
+                events.append({"event": "edit", "time": captured, "post": post})
+            new_nos.append(no)
+            new_hashes.append(post_hash)
+        for post in thread["posts"]:
+            if post["no"] > last_no:
+                events.append({"event": "post", "time": captured, "post": post})
+                new_nos.append(post["no"])
+                new_hashes.append(_post_hash(post))
+
+        if events:
+            _append_events(path, events)
+        with self._lock:
+            self._index[path] = (new_nos, new_hashes)
+            self._last_used[path] = time.monotonic()
+        return len(events)
+
+    def extend(self, path: Path, posts: list, captured: float = None) -> int:
+        """Append some posts of a thread to its segment, without a full capture.
+
+        Posts newer than the last stored one are appended as ``post`` events and
+        stored posts whose content changed as ``edit`` events. As the capture is
+        partial, nothing is deleted. Returns the event count.
+        """
+        if captured is None:
+            captured = time.time()
+        captured = int(captured)
+        path = Path(path)
+        with self._lock:
+            index = self._index.get(path)
+        if index is None:
+            index = self._load_index(path)
+        nos, hashes = index
+
+        events = []
+        for post in sorted(posts, key=lambda post: post["no"]):
+            post_hash = _post_hash(post)
+            if not nos or post["no"] > nos[-1]:
+                events.append({"event": "post", "time": captured, "post": post})
+                nos.append(post["no"])
+                hashes.append(post_hash)
+                continue
+            position = bisect.bisect_left(nos, post["no"])
+            if nos[position] == post["no"] and hashes[position] != post_hash:
+                events.append({"event": "edit", "time": captured, "post": post})
+                hashes[position] = post_hash
+
+        if events:
+            _append_events(path, events)
+        with self._lock:
+            self._index[path] = (nos, hashes)
+            self._last_used[path] = time.monotonic()
+        return len(events)
+
+    def forget_idle(self, max_idle: float):
+        """Drop the cached index of segments not written to in ``max_idle`` seconds."""
+        cutoff = time.monotonic() - max_idle
+        with self._lock:
+            for path in [
+                path for path, used in self._last_used.items() if used < cutoff
+            ]:
+                del self._index[path]
+                del self._last_used[path]
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(frame: bytes) -> bytes:
+    if frame[:4] == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise ImportError(
+                "Reading zstd segments requires the zstandard package: pip install zstandard"
+            )
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return gzip.decompress(frame)
+
+
+class segment_store:
+    """Compressed storage of thread captures in one segment per board and day.
+
+    Every capture of a thread is compressed on its own (a gzip member or zstd
+    frame) and appended to ``saves/<day>/segments/<board>.seg``. A line with the
+    thread number, byte offset and length of the frame is appended to the
+    matching ``<board>.idx``, so readers can seek straight to one thread. The
+    newest frame of a thread supersedes the older ones. Once superseded frames
+    make up more than ``1 - 1 / compact_ratio`` of a segment of at least
+    ``min_compact_bytes``, the segment is compacted in place, so it never grows
+    much beyond ``compact_ratio`` times the size of the latest captures.
+    """
+
+    def __init__(
+        self,
+        compression: str = "gzip",
+        compact_ratio: float = 2,
+        min_compact_bytes: int = 2**20,
+    ):
+        if compression not in ("gzip", "zstd"):
+            raise ValueError(f"Unknown segment compression {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError(
+                "zstd segments require the zstandard package: pip install zstandard"
+            )
+        self.compression = compression
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self._lock = threading.Lock()
+        self._offsets = {}
+
+    def _segment(self, segment_path: Path):
+        # Offsets of the newest frame of every thread, along with the bytes in
+        # those frames and in the whole segment, kept for the segment each
+        # board was last written to.
+        path, offsets, sizes = self._offsets.get(
+            segment_path.stem, (None, None, None)
+        )
+        if path != segment_path:
+            offsets = {}
+            if segment_path.with_suffix(".idx").exists():
+                reader = segment_reader(segment_path)
+                for no, versions in reader.versions.items():
+                    offsets[no] = (versions[-1]["offset"], versions[-1]["length"])
+            size = segment_path.stat().st_size if segment_path.exists() else 0
+            sizes = [sum(length for _, length in offsets.values()), size]
+            self._offsets[segment_path.stem] = (segment_path, offsets, sizes)
+        return offsets, sizes
+
+    def _segment_offsets(self, segment_path: Path):
+        return self._segment(segment_path)[0]
+
+    def has(self, folder: Path, board: str, no: int) -> bool:
+        segment_path = Path(folder) / (board + ".seg")
+        with self._lock:
+            return int(no) in self._segment_offsets(segment_path)
+
+    def read(self, folder: Path, board: str, no: int):
+        """Return the newest capture of a thread from its board's segment, or None."""
+        segment_path = Path(folder) / (board + ".seg")
+        with self._lock:
+            location = self._segment_offsets(segment_path).get(int(no))
+            if location is None:
+                return None
+            with open(segment_path, "rb") as segment:
+                segment.seek(location[0])
+                frame = segment.read(location[1])
+        return json.loads(_decompress(frame))
+
+    def append(
+        self, folder: Path, board: str, no: int, thread: dict, captured: float = None
+    ) -> int:
+        """Append a capture of a thread to its board's segment, returning the bytes written."""
+        if captured is None:
+            captured = time.time()
+        frame = _compress(json.dumps(thread).encode("utf-8"), self.compression)
+        segment_path = Path(folder) / (board + ".seg")
+        with self._lock:
+            offsets, sizes = self._segment(segment_path)
+            with open(segment_path, "ab") as segment:
+                offset = segment.tell()
+                segment.write(frame)
+            previous = offsets.get(int(no))
+            offsets[int(no)] = (offset, len(frame))
+            sizes[0] += len(frame) - (previous[1] if previous else 0)
+            sizes[1] = offset + len(frame)
+            with open(segment_path.with_suffix(".idx"), "a") as index:
+                index.write(
+                    json.dumps(
+                        {
+                            "no": int(no),
+                            "offset": offset,
+                            "length": len(frame),
+                            "captured": int(captured),
+                        }
+                    )
+                    + "\n"
+                )
+            if (
+                sizes[1] >= self.min_compact_bytes
+                and sizes[1] > self.compact_ratio * sizes[0]
+            ):
+                self._compact(segment_path)
+        return len(frame)
+
+    def _compact(self, segment_path: Path):
+        # Called holding the lock, so no frame is appended mid-rewrite.
+        compact_segment(segment_path)
+        if self._offsets.get(segment_path.stem, (None,))[0] == segment_path:
+            del self._offsets[segment_path.stem]
+
+    def compact(self, segment_path: Path):
+        """Drop the superseded frames of a segment, returning the files rewritten."""
+        segment_path = Path(segment_path)
+        if not segment_path.with_suffix(".idx").exists():
+            return []
+        with self._lock:
+            self._compact(segment_path)
+        return [segment_path, segment_path.with_suffix(".idx")]
+
+
+class segment_reader:
+    """Random access to the threads stored in a segment written by ``segment_store``."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path).with_suffix(".seg")
+        self.versions = {}
+        with open(self.path.with_suffix(".idx"), "r") as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # A torn last line from an interrupted write.
+                    continue
+                self.versions.setdefault(entry["no"], []).append(entry)
+
+    def threads(self):
+        """Thread numbers stored in the segment."""
+        return sorted(self.versions)
+
+    def read(self, no: int, version: int = -1) -> dict:
+        """Decompress a single capture of a thread, by default the newest."""
+        entry = self.versions[int(no)][version]
+        with open(self.path, "rb") as segment:
+            segment.seek(entry["offset"])
+            return json.loads(_decompress(segment.read(entry["length"])))
+
+    def __iter__(self):
+        """Yield ``(no, thread)`` for the newest capture of every thread."""
+        for no in self.threads():
+            yield no, self.read(no)
+
+
+_STOP = object()
+
+
+class write_behind:
+    """Bounded write-behind stage that persists captures off the fetch threads.
+
+    Jobs are callables that write to disk and return the paths they wrote.
+    Each job has a key (a thread or board) and jobs with the same key always
+    run in the order they were submitted, on the same writer thread. Every
+    writer has a queue of at most ``max_queued / writers`` jobs, and
+    ``submit`` blocks while the queue is full, so fetching slows to the pace
+    of the disk instead of buffering without bound. Written files are fsynced
+    in batches every ``fsync_interval`` seconds (never if 0). With no writers
+    jobs run inline.
+    """
+
+    def __init__(
+        self,
+        writers: int = 2,
+        max_queued: int = 256,
+        fsync_interval: float = 5,
+        metrics=None,
+    ):
+        self.fsync_interval = fsync_interval
+        self._metrics = metrics
+        self._logger = logging.getLogger("4chan_requester.writer")
+        self._queues = [
+            queue.Queue(max(1, max_queued // writers)) for _ in range(writers)
+        ]
+        self._dirty = set()
+        self._last_sync = time.monotonic()
+        self._threads = [
+            threading.Thread(
+                target=self._work, args=(jobs,), name=f"writer_{number}", daemon=True
+            )
+            for number, jobs in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, job):
+        try:
+            return job() or ()
+        except Exception:
+            self._logger.exception("Write-behind job failed")
+            return ()
+
+    def _sync(self, paths: set):
+        started = time.monotonic()
+        for path in paths:
+            try:
+                descriptor = os.open(path, os.O_RDONLY)
+            except OSError:
+                # Replaced or removed since it was written.
+                continue
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        if self._metrics is not None and paths:
+            self._metrics.inc("fourtct_fsyncs_total", len(paths))
+            self._metrics.inc("fourtct_fsync_seconds_total", time.monotonic() - started)
+
+    def _work(self, jobs: queue.Queue):
+        dirty = set()
+        last_sync = time.monotonic()
+        while True:
+            try:
+                job = jobs.get(timeout=self.fsync_interval or None)
+            except queue.Empty:
+                job = None
+            if job is _STOP:
+                if self.fsync_interval:
+                    self._sync(dirty)
+                return
+            if job is not None:
+                dirty.update(self._run(job))
+            if not self.fsync_interval:
+                dirty.clear()
+            elif time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync(dirty)
+                dirty = set()
+                last_sync = time.monotonic()
+
+    def queued(self) -> int:
+        return sum(jobs.qsize() for jobs in self._queues)
+
+    def submit(self, key, job):
+        """Queue ``job`` behind earlier jobs with the same ``key``, blocking while the queue is full."""
+        if not self._queues:
+            written = self._run(job)
+            if self.fsync_interval:
+                self._dirty.update(written)
+                if time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync(self._dirty)
+                    self._dirty = set()
+                    self._last_sync = time.monotonic()
+            return
+        jobs = self._queues[hash(key) % len(self._queues)]
+        try:
+            jobs.put_nowait(job)
+        except queue.Full:
+            started = time.monotonic()
+            jobs.put(job)
+            if self._metrics is not None:
+                self._metrics.inc(
+                    "fourtct_write_backpressure_seconds_total",
+                    time.monotonic() - started,
+                )
+        if self._metrics is not None:
+            self._metrics.set("fourtct_write_queue_depth", self.queued())
+
+    def close(self):
+        """Write every queued job, fsync what was written and stop the writers."""
+        for jobs in self._queues:
+            jobs.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        if self._queues:
+            self._queues = []
+        elif self.fsync_interval:
+            self._sync(self._dirty)
+        self._dirty = set()
+        if self._metrics is not None:
+            self._metrics.set("fourtct_write_queue_depth", 0)
+
+
+def compact_segment(path: Path):
+    """Rewrite a segment keeping only the newest capture of every thread."""
+    reader = segment_reader(path)
+    index_path = reader.path.with_suffix(".idx")
+    temporary_segment = reader.path.with_name(reader.path.name + ".tmp")
+    temporary_index = index_path.with_name(index_path.name + ".tmp")
+    with open(reader.path, "rb") as segment, open(
+        temporary_segment, "wb"
+    ) as outfile, open(temporary_index, "w") as index:
+        for no in reader.threads():
+            entry = reader.versions[no][-1]
+            segment.seek(entry["offset"])
+            index.write(json.dumps(dict(entry, offset=outfile.tell())) + "\n")
+            outfile.write(segment.read(entry["length"]))
+    os.replace(temporary_segment, reader.path)
+    os.replace(temporary_index, index_path)
+
+
+def convert_saves(saves: Path, compression: str = "gzip", remove: bool = False):
+    """Migrate ``saves/<day>/threads/<board>/`` folders into compressed segments.
+
+    JSON documents are stored as they are and JSONL segments are compacted
+    first. Threads already present in a board's segment are skipped, so an
+    interrupted conversion can simply be run again. With ``remove`` the
+    converted files are deleted.
+    """
+    store = segment_store(compression)
+    converted = 0
+    # Captures of later days may be based on earlier ones, so nothing is
+    # removed until every folder is converted.
+    to_remove = []
+    for board_folder in sorted(Path(saves).glob("*/threads/*")):
+        if not board_folder.is_dir():
+            continue
+        board = board_folder.name
+        segment_folder = board_folder.parent.parent / "segments"
+        segment_folder.mkdir(parents=True, exist_ok=True)
+        index_path = segment_folder / (board + ".idx")
+        done = (
+            set(segment_reader(index_path).versions) if index_path.exists() else set()
+        )
+        # Sorted by capture time, so the newest file of a thread is stored last.
+        for path in sorted(
+            board_folder.iterdir(), key=lambda path: path.stem.split("_", 1)[-1]
+        ):
+            if path.suffix == ".jsonl":
+                thread = compact_thread(path)
+            elif path.suffix == ".json":
+                with open(path, "r") as infile:
+                    try:
+                        thread = json.load(infile)
+                    except json.decoder.JSONDecodeError:
+                        continue
+            else:
+                continue
+            no = int(path.name.split("_")[0])
+            if no not in done and thread and thread.get("posts"):
+                store.append(segment_folder, board, no, thread, path.stat().st_mtime)
+                converted += 1
+            if remove:
+                to_remove.append(path)
+    for path in to_remove:
+        path.unlink()
+        if not any(path.parent.iterdir()):
+            path.parent.rmdir()
+    return converted
+
+
+def _thread_files(saves: Path):
+    # Every per-thread capture file in a saves tree, grouped by board and
+    # thread, oldest first.
+    boards = {}
+    for board_folder in sorted(Path(saves).glob("*/threads/*")):
+        if not board_folder.is_dir():
+            continue
+        names = {path.name: path for path in board_folder.iterdir()}
+        threads = boards.setdefault(board_folder.name, {})
+        for name, path in sorted(names.items()):
+            if path.suffix not in (".json", ".jsonl"):
+                continue
+            if path.suffix == ".json" and path.stem + ".jsonl" in names:
+                # Compacted copy of an append-only segment.
+                continue
+            no, _, captured = path.stem.partition("_")
+            threads.setdefault(int(no), []).append(
+                (board_folder.parent.parent.name, captured, path)
+            )
+    for board, threads in boards.items():
+        for no, files in threads.items():
+            yield board, no, [path for _, _, path in sorted(files)]
+
+
+def dedupe_saves(saves: Path):
+    """Store later captures of a thread as changes to its earlier captures.
+
+    Every capture of a thread after its first, JSON document or segment, is
+    rewritten as an append-only segment opening with a ``base`` event that
+    refers to the previous capture, followed by the posts added, edited or
+    deleted since. Segments that already have a base are left alone, so the
+    tool can be run again as new days are collected. Returns the number of
+    captures rewritten and the bytes reclaimed.
+    """
+    store = delta_thread_store()
+    rewritten = 0
+    reclaimed = 0
+    for board, no, files in _thread_files(saves):
+        base = None
+        for path in files:
+            if path.suffix == ".jsonl":
+                first = next(iter_events(path), None)
+                if first is not None and first["event"] == "base":
+                    base = path
+                    continue
+                thread = compact_thread(path)
+            else:
+                with open(path, "r") as infile:
+                    try:
+                        thread = json.load(infile)
+                    except json.decoder.JSONDecodeError:
+                        continue
+            if not thread or not thread.get("posts"):
+                continue
+            if base is None:
+                base = path
+                continue
+            size = path.stat().st_size
+            segment = path.with_suffix(".jsonl")
+            temporary = segment.with_name(segment.name + ".tmp")
+            temporary.unlink(missing_ok=True)
+            store.append(temporary, thread, path.stat().st_mtime, base=base)
+            reclaimed += size - temporary.stat().st_size
+            os.replace(temporary, segment)
+            if segment != path:
+                path.unlink()
+            store.forget_idle(0)
+            rewritten += 1
+            base = segment
+    return rewritten, reclaimed
+
+
+def compact(paths: list, overwrite: bool = False):
+    """Compact thread storage under ``paths``.
+
+    Writes the ``.json`` document beside every ``.jsonl`` segment and drops
+    superseded captures from every compressed ``.seg`` segment.
+    """
+    written = 0
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            files = [path]
+        else:
+            files = sorted([*path.rglob("*.jsonl"), *path.rglob("*.seg")])
+        for segment in files:
+            if segment.suffix == ".seg":
+                compact_segment(segment)
+                written += 1
+                continue
+            outpath = segment.with_suffix(".json")
+            if outpath.exists() and not overwrite:
+                continue
+            with open(outpath, "w") as outfile:
+                json.dump(compact_thread(segment), outfile, indent=2)
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="4TCT storage tools")
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Write the per-thread JSON document for append-only thread segments, and drop superseded captures from compressed segments (only run on days no longer being written)",
+    )
+    compact_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Segment files, or folders (e.g. data/saves) to search for segments",
+    )
+    compact_parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Overwrite documents that already exist",
+    )
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Migrate the per-thread files of a saves folder into compressed segments",
+    )
+    convert_parser.add_argument("saves", help="The saves folder, e.g. data/saves")
+    convert_parser.add_argument(
+        "-c",
+        "--compression",
+        choices=["gzip", "zstd"],
+        default="gzip",
+        help="Compression used for the segments, zstd needs the zstandard package",
+    )
+    convert_parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="Delete the per-thread files once they are converted",
+    )
+    dedupe_parser = subparsers.add_parser(
+        "dedupe",
+        help="Store the captures of threads collected over several days as changes to their earlier captures (only run on days no longer being written)",
+    )
+    dedupe_parser.add_argument("saves", help="The saves folder, e.g. data/saves")
+    args = argparser.parse_args()
+    if args.command == "compact":
+        print(f"{compact(args.paths, overwrite=args.force)} files compacted")
+    elif args.command == "convert":
+        converted = convert_saves(args.saves, args.compression, remove=args.remove)
+        print(f"{converted} threads converted")
+    elif args.command == "dedupe":
+        rewritten, reclaimed = dedupe_saves(args.saves)
+        print(f"{rewritten} captures deduplicated, {reclaimed} bytes reclaimed")
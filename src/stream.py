@@ -0,0 +1,378 @@
+import json
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+class stdout_sink:
+    """Writes the stream to standard output."""
+
+    def write(self, data: bytes):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    def close(self):
+        sys.stdout.buffer.flush()
+
+
+class file_sink:
+    """Appends the stream to a local file, rotated by size and age.
+
+    Once the file reaches ``max_bytes`` or is ``interval`` seconds old it is
+    renamed to ``<stem>.<YYYYmmddHHMMSS><suffix>`` and a new file is started,
+    so consumers can follow the live file and pick up rotated ones at leisure.
+    A size or interval of 0 disables that trigger.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 0, interval: float = 0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._opened = time.time()
+
+    def _rotate(self):
+        self._file.close()
+        stamp = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+        rotated = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}")
+        count = 0
+        while rotated.exists():
+            # Rotated more than once within a second.
+            count += 1
+            rotated = self.path.with_name(
+                f"{self.path.stem}.{stamp}-{count}{self.path.suffix}"
+            )
+        os.replace(self.path, rotated)
+        self._open()
+
+    def write(self, data: bytes):
+        if self._file.tell() and (
+            (self.max_bytes and self._file.tell() + len(data) > self.max_bytes)
+            or (self.interval and time.time() - self._opened >= self.interval)
+        ):
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _socket_consumer:
+    # One connected consumer of a socket_sink: the data waiting for it, and
+    # the thread sending it, so a slow consumer never holds up the others.
+
+    def __init__(self, connection: socket.socket, sink):
+        self.connection = connection
+        self.chunks = deque()
+        self.buffered = 0
+        self.alive = True
+        self._sink = sink
+        self.thread = threading.Thread(
+            target=self._send, name="stream_consumer", daemon=True
+        )
+
+    def _send(self):
+        sink = self._sink
+        while True:
+            with sink._changed:
+                while self.alive and not self.chunks and not sink._closed:
+                    sink._changed.wait()
+                if not self.alive or not self.chunks:
+                    break
+                data = self.chunks.popleft()
+            try:
+                self.connection.sendall(data)
+            except OSError:
+                with sink._changed:
+                    sink._drop(self, "disconnected from")
+                break
+            with sink._changed:
+                self.buffered -= len(data)
+                sink._changed.notify_all()
+        self.connection.close()
+
+
+class socket_sink:
+    """Serves the stream to every consumer connected to a Unix domain socket.
+
+    Writes wait until at least one consumer is connected, so a collector with
+    no consumer fills its buffer and then pushes back rather than losing
+    posts. Every consumer has its own buffer of up to ``max_buffered`` bytes,
+    sent by its own thread. A write waits for room in the buffer of a slow
+    consumer, but a consumer that has not taken any data for
+    ``stall_timeout`` seconds is disconnected, as is one that disconnects.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_buffered: int = 16 * 2**20,
+        stall_timeout: float = 30,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        self.max_buffered = max_buffered
+        self.stall_timeout = stall_timeout
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(str(self.path))
+        self._server.listen()
+        self._consumers = []
+        self._closed = False
+        self._changed = threading.Condition()
+        self._logger = logging.getLogger("4chan_requester.stream")
+        threading.Thread(
+            target=self._accept, name="stream_accept", daemon=True
+        ).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                # The server socket was closed.
+                return
+            connection.settimeout(self.stall_timeout)
+            consumer = _socket_consumer(connection, self)
+            with self._changed:
+                if self._closed:
+                    connection.close()
+                    return
+                self._consumers.append(consumer)
+                self._changed.notify_all()
+            consumer.thread.start()
+            self._logger.info(f"Stream consumer connected to {self.path}")
+
+    def _drop(self, consumer: _socket_consumer, reason: str):
+        # Called holding _changed. Shutting the connection down wakes a
+        # consumer thread blocked sending to it.
+        if not consumer.alive:
+            return
+        consumer.alive = False
+        self._consumers.remove(consumer)
+        try:
+            consumer.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._changed.notify_all()
+        self._logger.info(f"Stream consumer {reason} {self.path}")
+
+    def write(self, data: bytes):
+        with self._changed:
+            while not self._closed:
+                while not self._consumers and not self._closed:
+                    self._changed.wait(1)
+                for consumer in list(self._consumers):
+                    deadline = time.monotonic() + self.stall_timeout
+                    while (
+                        consumer.alive
+                        and consumer.buffered
+                        and consumer.buffered + len(data) > self.max_buffered
+                    ):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or self._closed:
+                            self._drop(consumer, "stalled, disconnected from")
+                            break
+                        self._changed.wait(min(remaining, 1))
+                    if consumer.alive:
+                        consumer.chunks.append(data)
+                        consumer.buffered += len(data)
+                self._changed.notify_all()
+                if self._consumers:
+                    return
+        raise OSError(f"Stream socket {self.path} closed with no consumer")
+
+    def close(self, timeout: float = 5):
+        """Stop accepting consumers and close the socket.
+
+        Connected consumers have up to ``timeout`` seconds to take the data
+        buffered for them before they are disconnected.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+            consumers = list(self._consumers)
+        self._server.close()
+        deadline = time.monotonic() + timeout
+        for consumer in consumers:
+            consumer.thread.join(max(0, deadline - time.monotonic()))
+        with self._changed:
+            for consumer in list(self._consumers):
+                self._drop(consumer, "disconnected on close from")
+        for consumer in consumers:
+            consumer.thread.join(1)
+        self.path.unlink(missing_ok=True)
+
+
+def open_sink(target: str, max_bytes: int = 0, interval: float = 0):
+    """Open the sink named by ``target``: ``-`` for stdout, ``unix:<path>`` for a socket, otherwise a file."""
+    if target in ("-", "stdout"):
+        return stdout_sink()
+    if target.startswith("unix:"):
+        return socket_sink(target[len("unix:") :])
+    return file_sink(target, max_bytes, interval)
+
+
+class post_stream:
+    """Emits every newly seen post once, as a JSON line, to a sink.
+
+    ``emit`` is given the posts of a thread as they arrive and queues the ones
+    newer than the last post already emitted for that thread. A writer thread
+    serialises them (``{"board": ..., "thread": ..., **post}``, as written by
+    ``corpus.py``) and writes them to the sink in batches. At most
+    ``max_queued`` posts are buffered; when the buffer is full ``emit`` blocks
+    until the sink catches up, or with ``overflow="drop"`` drops the posts and
+    counts them instead. Once ``release`` or ``close`` is called ``emit`` never
+    blocks, dropping what does not fit. ``seen`` looks up the last post of a thread already
+    handled, e.g. from the crawl state, the first time the thread is emitted.
+    """
+
+    def __init__(
+        self,
+        sink,
+        max_queued: int = 10000,
+        overflow: str = "block",
+        seen=None,
+        metrics=None,
+    ):
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"Unknown stream overflow policy {overflow}")
+        self._sink = sink
+        self._overflow = overflow
+        self._seen = seen
+        self._metrics = metrics
+        self._logger = logging.getLogger("4chan_requester.stream")
+        self._queue = queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        self._last_no = {}
+        self._released = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._work, name="stream", daemon=True)
+        self._thread.start()
+
+    def _inc(self, name: str, value: float = 1):
+        if self._metrics is not None:
+            self._metrics.inc(name, value)
+
+    def emit(self, board: str, thread, posts: list) -> int:
+        """Queue the posts of a thread not emitted before, returning how many were queued."""
+        key = (board, str(thread))
+        with self._lock:
+            last_no = self._last_no.get(key)
+            if last_no is None and self._seen is not None:
+                last_no = self._seen(board, str(thread))
+            last_no = last_no or 0
+            new_posts = [post for post in posts if post["no"] > last_no]
+            if new_posts:
+                self._last_no[key] = max(post["no"] for post in new_posts)
+            elif key not in self._last_no:
+                self._last_no[key] = last_no
+        if self._stopped.is_set():
+            self._inc("fourtct_stream_dropped_total", len(new_posts))
+            return 0
+        for post in new_posts:
+            item = (board, int(thread), post)
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self._overflow == "block":
+                    self._wait_to_put(item)
+                else:
+                    self._inc("fourtct_stream_dropped_total")
+        if self._metrics is not None:
+            self._metrics.set("fourtct_stream_queue_depth", self._queue.qsize())
+        return len(new_posts)
+
+    def _wait_to_put(self, item):
+        started = time.monotonic()
+        while True:
+            if self._released.is_set():
+                self._inc("fourtct_stream_dropped_total")
+                break
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self._inc(
+            "fourtct_stream_backpressure_seconds_total", time.monotonic() - started
+        )
+
+    def release(self):
+        """Stop ``emit`` from blocking, so threads waiting on a full buffer return.
+
+        Called before the threads emitting posts are stopped, so none of them
+        is left waiting on a sink that will never catch up.
+        """
+        self._released.set()
+
+    def forget(self, board: str, thread):
+        """Drop what was emitted for a thread that will not be seen again."""
+        with self._lock:
+            self._last_no.pop((board, str(thread)), None)
+
+    def _work(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = "".join(
+                json.dumps({"board": board, "thread": thread, **post}) + "\n"
+                for board, thread, post in batch
+            ).encode("utf-8")
+            try:
+                self._sink.write(data)
+            except (OSError, ValueError) as error:
+                self._logger.warning(
+                    f"Writing {len(batch)} posts to the stream failed: {error}"
+                )
+                self._inc("fourtct_stream_dropped_total", len(batch))
+            else:
+                self._inc("fourtct_stream_posts_total", len(batch))
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 10):
+        """Write out the queued posts and close the sink, within about ``timeout`` seconds.
+
+        A sink still blocked after ``timeout`` seconds (a socket with no
+        consumer, or with consumers not reading) is closed anyway, and the
+        posts not written by then are dropped.
+        """
+        self._released.set()
+        self._stopped.set()
+        self._thread.join(timeout)
+        self._sink.close()
+        self._thread.join(1)
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            dropped += 1
+        if dropped:
+            self._inc("fourtct_stream_dropped_total", dropped)
+            self._logger.warning(f"Dropped {dropped} posts not written to the stream")
+        if self._metrics is not None:
+            self._metrics.set("fourtct_stream_queue_depth", 0)
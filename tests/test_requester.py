@@ -0,0 +1,112 @@
+import json
+import logging
+
+import pytest
+
+from requester import requester
+from storage import compact_thread
+
+
+@pytest.fixture
+def collector(request, tmp_path, monkeypatch):
+    # Parametrize indirectly with a storage mode to use another than JSON.
+    monkeypatch.chdir(tmp_path)
+    instance = requester(
+        False,
+        False,
+        storage=getattr(request, "param", "json"),
+        stream_log_level=logging.WARNING,
+        metrics_interval=0,
+        debug_log=False,
+    )
+    yield instance
+    instance._stop_logging()
+    logging.getLogger("4chan_requester").removeHandler(instance._log_handler)
+    instance._state.close()
+
+
+def _post(no, com=""):
+    return {"no": no, "time": 1_600_000_000 + no, "com": com}
+
+
+def _entry(op, replies, last_replies, omitted=0):
+    return {
+        **op,
+        "replies": replies,
+        "omitted_posts": omitted,
+        "last_replies": last_replies,
+    }
+
+
+def _stored_posts(collector, board, no):
+    (path,) = (collector._base_save_path / "saves").glob(f"*/threads/{board}/{no}_*")
+    with open(path) as document:
+        return [post["no"] for post in json.load(document)["posts"]]
+
+
+def test_new_thread_is_saved_from_the_catalog_when_complete(collector):
+    entry = _entry(_post(100), 2, [_post(101), _post(102)])
+    assert collector._capture_from_catalog("g", "100", entry, None)
+    assert _stored_posts(collector, "g", "100") == [100, 101, 102]
+    assert collector._state.last_post_no("g", "100") == 102
+
+
+def test_new_thread_with_omitted_posts_falls_back(collector):
+    entry = _entry(_post(100), 7, [_post(106), _post(107)], omitted=5)
+    assert not collector._capture_from_catalog("g", "100", entry, None)
+
+
+def test_new_replies_extend_the_stored_capture(collector):
+    collector.save_thread("g", "100", {"posts": [_post(100), _post(101)]})
+    entry = _entry(_post(100), 3, [_post(101), _post(102), _post(103)])
+    assert collector._capture_from_catalog("g", "100", entry, 1)
+    assert _stored_posts(collector, "g", "100") == [100, 101, 102, 103]
+    assert collector._state.last_post_no("g", "100") == 103
+
+
+def test_replies_missing_from_the_catalog_fall_back(collector):
+    collector.save_thread("g", "100", {"posts": [_post(100), _post(101)]})
+    # Four replies were added but only the last three are listed.
+    entry = _entry(_post(100), 5, [_post(103), _post(104), _post(105)], omitted=2)
+    assert not collector._capture_from_catalog("g", "100", entry, 1)
+    assert collector._state.last_post_no("g", "100") == 101
+
+
+def test_thread_without_stored_state_falls_back(collector):
+    entry = _entry(_post(100), 1, [_post(101)])
+    assert not collector._capture_from_catalog("g", "100", entry, 0)
+
+
+def test_op_only_update_keeps_the_last_post_number(collector):
+    collector.save_thread("g", "100", {"posts": [_post(100), _post(101), _post(102)]})
+    entry = _entry(_post(100, "edited"), 2, [_post(101), _post(102)])
+    assert collector._capture_from_catalog("g", "100", entry, 2)
+    assert collector._state.last_post_no("g", "100") == 102
+    # Later catalog merges still line up with the stored posts.
+    entry = _entry(_post(100, "edited"), 3, [_post(101), _post(102), _post(103)])
+    assert collector._capture_from_catalog("g", "100", entry, 2)
+    assert _stored_posts(collector, "g", "100") == [100, 101, 102, 103]
+
+
+def _stored_thread(collector, board, no):
+    outpath, existing, _ = collector._thread_location(board, no)
+    if collector._storage == "segment":
+        return collector._segment_store.read(outpath, board, no)
+    if existing.suffix == ".jsonl":
+        return compact_thread(existing)
+    with open(existing) as document:
+        return json.load(document)
+
+
+@pytest.mark.parametrize("collector", ["json", "delta", "segment"], indirect=True)
+def test_catalog_op_is_merged_over_the_stored_op(collector):
+    # unique_ips is only served by the thread endpoint, not the catalog.
+    op = {**_post(100), "unique_ips": 3}
+    collector.save_thread("g", "100", {"posts": [op, _post(101)]})
+    entry = _entry(_post(100, "edited"), 2, [_post(101), _post(102)])
+    assert collector._capture_from_catalog("g", "100", entry, 1)
+
+    posts = _stored_thread(collector, "g", "100")["posts"]
+    assert [post["no"] for post in posts] == [100, 101, 102]
+    assert posts[0]["com"] == "edited"
+    assert posts[0]["unique_ips"] == 3
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+
+from search import comment_text, search_index
+
+
+def _time(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp())
+
+
+def test_comment_text_strips_markup():
+    comment = '<a href="#p1" class="quotelink">&gt;&gt;1</a><br>fish &amp; chips'
+    assert comment_text(comment) == ">>1\nfish & chips"
+
+
+def test_date_bounds_include_the_whole_last_day(tmp_path):
+    index = search_index(tmp_path / "search.sqlite3")
+    index.add_posts(
+        "g",
+        100,
+        [
+            {"no": 100, "time": _time("2023-06-30T23:59:59"), "com": "fish"},
+            {"no": 101, "time": _time("2023-07-01T00:00:00"), "com": "fish"},
+            {"no": 102, "time": _time("2023-07-31T23:59:59"), "com": "fish"},
+            {"no": 103, "time": _time("2023-08-01T00:00:00"), "com": "fish"},
+        ],
+    )
+    hits = index.search("fish", since="2023-07-01", until="2023-07-31")
+    assert sorted(hit.no for hit in hits) == [101, 102]
+    hits = index.search("fish", until="2023-07-31T12:00")
+    assert sorted(hit.no for hit in hits) == [100, 101]
+    index.close()
@@ -0,0 +1,179 @@
+import json
+
+from storage import (
+    compact,
+    compact_thread,
+    dedupe_saves,
+    delta_thread_store,
+    file_index,
+    iter_events,
+    segment_reader,
+    segment_store,
+)
+
+
+def _post(no, com=""):
+    return {"no": no, "time": 1_600_000_000 + no, "com": com}
+
+
+def _thread(*posts):
+    return {"posts": list(posts)}
+
+
+def test_append_then_compact_matches_latest_capture(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    store = delta_thread_store()
+    store.append(path, _thread(_post(100, "op"), _post(101), _post(102)), 1)
+    latest = _thread(_post(100, "op edited"), _post(102), _post(103))
+    store.append(path, latest, 2)
+
+    assert [event["event"] for event in iter_events(path)] == [
+        "post",
+        "post",
+        "post",
+        "edit",
+        "delete",
+        "post",
+    ]
+    assert compact_thread(path) == latest
+
+
+def test_unchanged_capture_appends_nothing(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    store = delta_thread_store()
+    thread = _thread(_post(100), _post(101))
+    assert store.append(path, thread, 1) == 2
+    assert store.append(path, thread, 2) == 0
+    # A fresh store reads the index back from the segment.
+    assert delta_thread_store().append(path, thread, 3) == 0
+
+
+def test_extend_adds_and_edits_without_deleting(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    store = delta_thread_store()
+    store.append(path, _thread(_post(100), _post(101), _post(102)), 1)
+    store.extend(path, [_post(102, "edited"), _post(103)], 2)
+
+    assert compact_thread(path) == _thread(
+        _post(100), _post(101), _post(102, "edited"), _post(103)
+    )
+
+
+def test_compact_writes_document_beside_segment(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    thread = _thread(_post(100), _post(101))
+    delta_thread_store().append(path, thread, 1)
+
+    assert compact([tmp_path]) == 1
+    with open(path.with_suffix(".json")) as document:
+        assert json.load(document) == thread
+    # Existing documents are only rewritten when asked to.
+    assert compact([tmp_path]) == 0
+    assert compact([tmp_path], overwrite=True) == 1
+
+
+def test_file_index_retains_only_folders_under_root(tmp_path):
+    index = file_index()
+    yesterday = tmp_path / "2023_07_01" / "threads" / "g"
+    today = tmp_path / "2023_07_02" / "threads" / "g"
+    index.ensure_folder(yesterday)
+    index.ensure_folder(today)
+    index.add(today / "100_12_00_00.json")
+
+    assert index.retain(tmp_path / "2023_07_02") == 1
+    assert index.get(today, "100", ".json") == today / "100_12_00_00.json"
+    assert set(index._folders) == {today}
+
+
+def test_new_day_segment_continues_from_its_base(tmp_path):
+    yesterday = tmp_path / "2023_07_01" / "threads" / "g" / "100_23_00_00.jsonl"
+    today = tmp_path / "2023_07_02" / "threads" / "g" / "100_00_10_00.jsonl"
+    yesterday.parent.mkdir(parents=True)
+    today.parent.mkdir(parents=True)
+    store = delta_thread_store()
+    store.append(yesterday, _thread(_post(100), _post(101), _post(102)), 1)
+    latest = _thread(_post(100), _post(102, "edited"), _post(103))
+    store.append(today, latest, 2, base=yesterday)
+
+    events = list(iter_events(today))
+    assert events[0]["event"] == "base"
+    assert events[0]["path"] == "../../../2023_07_01/threads/g/100_23_00_00.jsonl"
+    # Only the changes since yesterday's capture are stored today.
+    assert [event["event"] for event in events[1:]] == ["delete", "edit", "post"]
+    assert compact_thread(today) == latest
+    assert compact_thread(yesterday) == _thread(_post(100), _post(101), _post(102))
+
+
+def _save_document(path, thread):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as document:
+        json.dump(thread, document)
+
+
+def test_dedupe_rewrites_later_days_and_is_idempotent(tmp_path):
+    first = _thread(_post(100), _post(101))
+    second = _thread(_post(100), _post(101, "edited"), _post(102))
+    third = _thread(_post(100), _post(102), _post(103))
+    _save_document(tmp_path / "2023_07_01/threads/g/100_10_00_00.json", first)
+    _save_document(tmp_path / "2023_07_02/threads/g/100_09_00_00.json", second)
+    _save_document(tmp_path / "2023_07_03/threads/g/100_08_00_00.json", third)
+
+    rewritten, reclaimed = dedupe_saves(tmp_path)
+    assert rewritten == 2
+    files = sorted(path.relative_to(tmp_path) for path in tmp_path.rglob("100_*"))
+    assert [str(path) for path in files] == [
+        "2023_07_01/threads/g/100_10_00_00.json",
+        "2023_07_02/threads/g/100_09_00_00.jsonl",
+        "2023_07_03/threads/g/100_08_00_00.jsonl",
+    ]
+    # Each day still replays to the capture it held, through the base chain.
+    assert compact_thread(tmp_path / files[1]) == second
+    assert compact_thread(tmp_path / files[2]) == third
+
+    contents = {path: (tmp_path / path).read_bytes() for path in files}
+    assert dedupe_saves(tmp_path) == (0, 0)
+    assert {path: (tmp_path / path).read_bytes() for path in files} == contents
+
+
+def test_torn_last_line_is_skipped_and_replaced_on_append(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    store = delta_thread_store()
+    store.append(path, _thread(_post(100), _post(101)), 1)
+    with open(path, "a") as segment:
+        segment.write('{"event": "post", "time": 2, "post": {"no": 1')
+
+    assert compact_thread(path) == _thread(_post(100), _post(101))
+    latest = _thread(_post(100), _post(101), _post(102))
+    delta_thread_store().append(path, latest, 3)
+    assert compact_thread(path) == latest
+    assert path.read_text().endswith("\n")
+
+
+def test_complete_last_line_without_newline_is_kept(tmp_path):
+    path = tmp_path / "100_12_00_00.jsonl"
+    delta_thread_store().append(path, _thread(_post(100), _post(101)), 1)
+    path.write_text(path.read_text().rstrip("\n"))
+
+    delta_thread_store().extend(path, [_post(102)], 2)
+    assert compact_thread(path) == _thread(_post(100), _post(101), _post(102))
+
+
+def test_segment_is_compacted_once_mostly_superseded(tmp_path):
+    store = segment_store(min_compact_bytes=0)
+    thread = _thread(_post(100))
+    for reply in range(101, 121):
+        thread = _thread(*thread["posts"], _post(reply, "x" * 100))
+        store.append(tmp_path, "g", 100, thread)
+        store.append(tmp_path, "g", 200, _thread(_post(200)))
+    segment = tmp_path / "g.seg"
+
+    reader = segment_reader(segment)
+    assert reader.threads() == [100, 200]
+    assert sum(len(versions) for versions in reader.versions.values()) < 6
+    assert store.read(tmp_path, "g", 100) == thread
+    assert dict(reader) == {100: thread, 200: _thread(_post(200))}
+
+    assert store.compact(segment) == [segment, tmp_path / "g.idx"]
+    versions = segment_reader(segment).versions.values()
+    assert sum(len(captures) for captures in versions) == 2
+    assert store.read(tmp_path, "g", 200) == _thread(_post(200))